@@ -0,0 +1,223 @@
+"""
+Analytics Module
+
+Answers aggregation queries (group-by, top-N, time buckets) with an embedded
+DuckDB engine. DuckDB attaches the pipeline's SQLite database read-only, or
+reads Parquet files if ANALYTICS_PARQUET is set, so no extra service is needed.
+"""
+import os
+import logging
+import threading
+from datetime import date, datetime
+
+from schema import DATABASE_URL, engine, list_partitions, processed_data_sql
+from query import candidate_id_ranges
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Columns that may appear in group_by and metrics; anything else is rejected,
+# which also keeps user input out of the generated SQL
+GROUP_BY_COLUMNS = [
+    'customer_location', 'gender', 'mobile_name', 'from_facebook',
+    'followed_page', 'previous_purchase', 'heard_of_shop', 'source_file'
+]
+METRIC_COLUMNS = ['sell_price', 'age']
+METRIC_OPS = ['count', 'sum', 'avg', 'min', 'max']
+TIME_GRAINS = ['day', 'week', 'month', 'quarter', 'year']
+MAX_LIMIT = 1000
+
+ANALYTICS_PARQUET = os.getenv('ANALYTICS_PARQUET')
+
+SQLITE_EXTENSION_MISSING = (
+    "The analytics engine needs DuckDB's sqlite extension; install it once with "
+    "python -c \"import duckdb; duckdb.install_extension('sqlite')\""
+)
+
+_connection = None
+_connection_lock = threading.Lock()
+
+
+def _sqlite_path():
+    """Filesystem path of the pipeline's SQLite database"""
+    if not DATABASE_URL.startswith('sqlite:///'):
+        raise RuntimeError("The analytics engine needs a SQLite DATABASE_URL or ANALYTICS_PARQUET")
+    return DATABASE_URL[len('sqlite:///'):]
+
+
+def _quote(value):
+    """Quote a string as a SQL literal"""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def get_connection():
+    """Return the shared DuckDB connection, creating it on first use"""
+    global _connection
+
+    with _connection_lock:
+        if _connection is None:
+            try:
+                import duckdb
+            except ImportError:
+                raise RuntimeError("The analytics engine requires the 'duckdb' package (pip install duckdb)")
+
+            # DDL cannot take bound parameters, so quote the paths as literals
+            conn = duckdb.connect(database=':memory:')
+            if ANALYTICS_PARQUET:
+                conn.execute(f"CREATE VIEW sales AS SELECT * FROM read_parquet({_quote(ANALYTICS_PARQUET)})")
+            else:
+                # Never download extensions while serving; the sqlite extension is installed once at setup
+                conn.execute("SET autoinstall_known_extensions = false")
+                try:
+                    conn.execute("LOAD sqlite")
+                except duckdb.Error:
+                    conn.close()
+                    raise RuntimeError(SQLITE_EXTENSION_MISSING)
+                conn.execute(f"ATTACH {_quote(_sqlite_path())} AS pipeline (TYPE SQLITE, READ_ONLY)")
+            logging.info("DuckDB analytics engine initialized")
+            _connection = conn
+
+    # Each caller gets its own cursor; DuckDB connections are not thread-safe
+    return _connection.cursor()
+
+
+def _sales_source(filters):
+    """FROM clause source for the sales rows a query can touch
+
+    For the SQLite database only the monthly partitions overlapping the date
+    filters, and not ruled out by their zone maps, are read. The dimension
+    tables are joined inside DuckDB rather than scanning the SQLite view row
+    by row.
+    """
+    if ANALYTICS_PARQUET:
+        return "sales"
+    names = []
+    with engine.connect() as conn:
+        for partition in list_partitions(conn, filters.get('start_date'), filters.get('end_date')):
+            ranges = candidate_id_ranges(conn, partition, filters.get('start_date'), filters.get('end_date'),
+                                         filters.get('min_age'), filters.get('max_age'))
+            if ranges != []:
+                names.append(partition.name)
+    return f"({processed_data_sql(schema='pipeline', partitions=names)}) AS sales"
+
+
+def _metric_alias(metric):
+    if metric['op'] == 'count':
+        return 'count'
+    return f"{metric['op']}_{metric['column']}"
+
+
+def validate_spec(spec):
+    """Check an aggregation spec, raising ValueError on anything not allowed"""
+    for column in spec.get('group_by') or []:
+        if column not in GROUP_BY_COLUMNS:
+            raise ValueError(f"Cannot group by '{column}'; allowed: {', '.join(GROUP_BY_COLUMNS)}")
+
+    metrics = spec.get('metrics') or []
+    if not metrics:
+        raise ValueError("At least one metric is required")
+    for metric in metrics:
+        if metric.get('op') not in METRIC_OPS:
+            raise ValueError(f"Unsupported metric op '{metric.get('op')}'; allowed: {', '.join(METRIC_OPS)}")
+        if metric['op'] != 'count' and metric.get('column') not in METRIC_COLUMNS:
+            raise ValueError(f"Cannot aggregate '{metric.get('column')}'; allowed: {', '.join(METRIC_COLUMNS)}")
+
+    time_grain = spec.get('time_grain')
+    if time_grain is not None and time_grain not in TIME_GRAINS:
+        raise ValueError(f"Unsupported time_grain '{time_grain}'; allowed: {', '.join(TIME_GRAINS)}")
+
+    order_by = spec.get('order_by')
+    if order_by is not None and order_by not in [_metric_alias(m) for m in metrics]:
+        raise ValueError("order_by must be one of the requested metrics")
+
+    limit = spec.get('limit', 100)
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+
+
+def build_query(spec):
+    """Build the SQL and parameters for a validated aggregation spec"""
+    select_columns = []
+    group_columns = []
+
+    if spec.get('time_grain'):
+        select_columns.append(f"date_trunc('{spec['time_grain']}', date) AS period")
+        group_columns.append('period')
+    for column in spec.get('group_by') or []:
+        select_columns.append(column)
+        group_columns.append(column)
+
+    for metric in spec['metrics']:
+        if metric['op'] == 'count':
+            select_columns.append("COUNT(*) AS count")
+        else:
+            select_columns.append(f"{metric['op'].upper()}({metric['column']}) AS {_metric_alias(metric)}")
+
+    # Same filters as /data
+    conditions = []
+    params = []
+    filters = spec.get('filters') or {}
+    if filters.get('start_date'):
+        conditions.append("date >= ?")
+        params.append(filters['start_date'])
+    if filters.get('end_date'):
+        conditions.append("date <= ?")
+        params.append(filters['end_date'])
+    if filters.get('location'):
+        conditions.append("customer_location ILIKE ?")
+        params.append(f"%{filters['location']}%")
+    if filters.get('gender'):
+        conditions.append("gender = ?")
+        params.append(filters['gender'])
+    if filters.get('min_age') is not None:
+        conditions.append("age >= ?")
+        params.append(filters['min_age'])
+    if filters.get('max_age') is not None:
+        conditions.append("age <= ?")
+        params.append(filters['max_age'])
+    if filters.get('mobile_name'):
+        conditions.append("mobile_name ILIKE ?")
+        params.append(f"%{filters['mobile_name']}%")
+
+    query = f"SELECT {', '.join(select_columns)} FROM {_sales_source(filters)}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if group_columns:
+        query += f" GROUP BY {', '.join(group_columns)}"
+
+    if spec.get('order_by'):
+        query += f" ORDER BY {spec['order_by']} DESC"
+    elif group_columns:
+        query += f" ORDER BY {', '.join(group_columns)}"
+    query += " LIMIT ?"
+    params.append(spec.get('limit', 100))
+
+    return query, params
+
+
+def run_aggregation(spec):
+    """Validate and run an aggregation spec, returning columns and rows"""
+    validate_spec(spec)
+    query, params = build_query(spec)
+    logging.info(f"Running aggregation: {query} with params {params}")
+
+    cursor = get_connection()
+    try:
+        cursor.execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        rows = []
+        for row in cursor.fetchall():
+            item = {}
+            for column, value in zip(columns, row):
+                # Convert datetime objects to ISO format strings
+                if isinstance(value, (datetime, date)):
+                    value = value.isoformat()
+                item[column] = value
+            rows.append(item)
+    finally:
+        cursor.close()
+
+    return {
+        "columns": columns,
+        "rows": rows
+    }
@@ -1,15 +1,24 @@
 """
 API Module using FastAPI
 """
-from fastapi import FastAPI, Depends, HTTPException, Query, Header
+from fastapi import FastAPI, Depends, HTTPException, Path, Query, Header
 from fastapi.security import APIKeyHeader
 from typing import Optional, List, Dict, Any
 from datetime import date, datetime
+import os
+import re
 import time
+import uuid
+import random
 from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
 import logging
 
-from database import get_data, initialize_database
+from query import get_data, get_data_batch, get_customer, ensure_database, warm_up
+from analytics import run_aggregation
+from profiling import PROFILE_DIR, StackSampler, prune_profiles
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,6 +31,11 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Prime statements and caches at import time, before a pre-forking server
+# (e.g. gunicorn --preload) forks its workers
+if os.getenv('API_WARMUP'):
+    warm_up()
+
 # API key security
 API_KEY_NAME = "X-API-Key"
 api_key_header = APIKeyHeader(name=API_KEY_NAME)
@@ -29,6 +43,7 @@ api_key_header = APIKeyHeader(name=API_KEY_NAME)
 # Simple in-memory rate limiting
 # in prod, you would use Redis or a similar distributed cache
 rate_limits = {}
+RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', '100'))
 
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
@@ -37,7 +52,7 @@ async def rate_limit_middleware(request: Request, call_next):
     api_key = request.headers.get(API_KEY_NAME, None)
     client_id = api_key or request.client.host
     
-    # Check rate limit (100 requests per minute)
+    # Check rate limit (RATE_LIMIT_PER_MINUTE requests per minute)
     current_time = time.time()
     if client_id in rate_limits:
         # Check if we need to reset the window
@@ -51,11 +66,11 @@ async def rate_limit_middleware(request: Request, call_next):
             # Increment count
             rate_limits[client_id]["count"] += 1
             # Check if limit exceeded
-            if rate_limits[client_id]["count"] > 100:
-                return {
+            if rate_limits[client_id]["count"] > RATE_LIMIT_PER_MINUTE:
+                return JSONResponse(status_code=429, content={
                     "error": "Rate limit exceeded",
                     "detail": "Too many requests. Please try again later."
-                }
+                })
     else:
         # First request from this client
         rate_limits[client_id] = {
@@ -67,12 +82,45 @@ async def rate_limit_middleware(request: Request, call_next):
     response = await call_next(request)
     return response
 
+# Request profiling: a PROFILE_SAMPLE_RATE fraction of requests made with an
+# admin key are stack-sampled, and profiles of requests slower than
+# PROFILE_THRESHOLD_MS are kept. Disabled (no middleware) unless both are set.
+ADMIN_API_KEYS = [key for key in os.getenv('ADMIN_API_KEYS', '').split(',') if key]
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_THRESHOLD_MS = float(os.getenv('PROFILE_THRESHOLD_MS', '500'))
+
+async def profile_middleware(request: Request, call_next):
+    """Middleware that profiles sampled admin requests"""
+    if request.headers.get(API_KEY_NAME) not in ADMIN_API_KEYS or random.random() >= PROFILE_SAMPLE_RATE:
+        return await call_next(request)
+
+    # Sync endpoints and run_in_threadpool work run on worker threads, so sample every thread
+    started = time.perf_counter()
+    with StackSampler() as sampler:
+        response = await call_next(request)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    response.headers["Server-Timing"] = f"app;dur={elapsed_ms:.1f}"
+    if elapsed_ms >= PROFILE_THRESHOLD_MS:
+        profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.folded"), 'w') as profile_file:
+            profile_file.write(sampler.collapsed())
+        prune_profiles(PROFILE_DIR)
+        response.headers["X-Profile-Id"] = profile_id
+        logger.info(f"Profiled slow request {request.method} {request.url.path} "
+                    f"({elapsed_ms:.0f} ms) as {profile_id}")
+    return response
+
+if ADMIN_API_KEYS and PROFILE_SAMPLE_RATE > 0:
+    app.middleware("http")(profile_middleware)
+
 def verify_api_key(api_key: str = Header(..., alias=API_KEY_NAME)):
     """Verify API key"""
-    # for simplicity, we're using hardcoded keys
+    # for simplicity, we're using hardcoded keys; admin keys are valid everywhere
     valid_keys = ["test_api_key", "demo_key"]
     
-    if api_key not in valid_keys:
+    if api_key not in valid_keys and api_key not in ADMIN_API_KEYS:
         raise HTTPException(
             status_code=401,
             detail="Invalid API key"
@@ -80,6 +128,16 @@ def verify_api_key(api_key: str = Header(..., alias=API_KEY_NAME)):
     
     return api_key
 
+def verify_admin_key(api_key: str = Header(..., alias=API_KEY_NAME)):
+    """Verify an admin API key, one of ADMIN_API_KEYS"""
+    if api_key not in ADMIN_API_KEYS:
+        raise HTTPException(
+            status_code=403,
+            detail="Admin API key required"
+        )
+
+    return api_key
+
 @app.get("/data")
 async def read_data(
     start_date: Optional[date] = Query(None, description="Start date for filtering data"),
@@ -129,12 +187,172 @@ async def read_data(
             detail="Failed to retrieve data"
         )
 
+class DataFilters(BaseModel):
+    """Filters shared with the /data endpoint"""
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    location: Optional[str] = None
+    gender: Optional[str] = None
+    min_age: Optional[int] = None
+    max_age: Optional[int] = None
+    mobile_name: Optional[str] = None
+
+
+class DataQuery(DataFilters):
+    """One /data query inside a batch"""
+    cursor: Optional[str] = Field(None, description="Cursor for pagination")
+    limit: int = Field(50, ge=1, le=100, description="Number of items to return")
+
+
+# Upper bound on queries per /data/batch request
+MAX_BATCH_QUERIES = 50
+
+
+class BatchRequest(BaseModel):
+    """Several /data queries answered in one request"""
+    queries: List[DataQuery] = Field(..., min_items=1, max_items=MAX_BATCH_QUERIES)
+
+
+class MetricSpec(BaseModel):
+    """A single aggregate, e.g. {"op": "sum", "column": "sell_price"}"""
+    op: str = Field(..., description="One of count, sum, avg, min, max")
+    column: Optional[str] = Field(None, description="sell_price or age (not needed for count)")
+
+
+class AggregationRequest(BaseModel):
+    """Aggregation spec for the /query endpoint"""
+    group_by: List[str] = Field(default_factory=list, description="Columns to group by")
+    metrics: List[MetricSpec] = Field(..., description="Aggregates to compute")
+    time_grain: Optional[str] = Field(None, description="Bucket dates by day, week, month, quarter or year")
+    filters: DataFilters = Field(default_factory=DataFilters)
+    order_by: Optional[str] = Field(None, description="Metric to sort by, descending (e.g. sum_sell_price)")
+    limit: int = Field(100, ge=1, le=1000, description="Maximum number of groups to return")
+
+
+@app.post("/query")
+async def query_data(
+    request: AggregationRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Run an aggregation over TechCorner sales data.
+
+    - Group by customer and product columns, optionally bucketed by time_grain
+    - Compute count, sum, avg, min or max of sell_price and age
+    - Filter with the same fields as /data
+    - Use order_by and limit for top-N queries
+    """
+    spec = request.dict()
+    try:
+        logger.info(f"Query request received with spec: {spec}")
+        # DuckDB blocks, so keep it off the event loop
+        return await run_in_threadpool(run_aggregation, spec)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    except RuntimeError as e:
+        # The analytics engine is not set up (missing duckdb or its sqlite extension)
+        logger.error(f"Analytics engine unavailable: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error in /query endpoint: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to run query"
+        )
+
+@app.post("/data/batch")
+async def read_data_batch(
+    request: BatchRequest,
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Run several /data queries in one request, e.g. all panels of a dashboard.
+
+    - Each query takes the same fields as /data, including cursor and limit
+    - All queries read the same snapshot over a single database session
+    - Identical queries run once; queries differing only in cursor or limit
+      share one COUNT
+    - Results come back in request order; a failed query has an error
+      instead of items
+    """
+    queries = [query.dict() for query in request.queries]
+    try:
+        logger.info(f"Batch request received with {len(queries)} queries")
+        results = await run_in_threadpool(get_data_batch, queries)
+    except Exception as e:
+        logger.error(f"Error in /data/batch endpoint: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to retrieve data"
+        )
+
+    return {
+        "results": [
+            result if result is not None else {"error": "Failed to retrieve data"}
+            for result in results
+        ]
+    }
+
+@app.get("/customers/{customer_id}")
+async def read_customer(
+    customer_id: int = Path(..., ge=0, le=2**63 - 1, description="Customer id; must fit a 64-bit database integer"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of purchases to return"),
+    api_key: str = Depends(verify_api_key)
+):
+    """
+    Get one customer's purchase summary and purchase history.
+
+    - Summary: first and last purchase, purchase count, total spend and the
+      engagement answers of the latest purchase
+    - Purchases: newest first, in the same shape as /data items
+    """
+    try:
+        result = await run_in_threadpool(get_customer, customer_id, limit)
+    except Exception as e:
+        logger.error(f"Error in /customers endpoint: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to retrieve customer"
+        )
+
+    if result is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Customer not found"
+        )
+    return result
+
+@app.get("/admin/profiles/{profile_id}", response_class=PlainTextResponse)
+async def read_profile(
+    profile_id: str,
+    api_key: str = Depends(verify_admin_key)
+):
+    """
+    Get a request profile in collapsed-stack format.
+
+    Feed it to flamegraph.pl or open it in speedscope. Admin keys only.
+    """
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+    if not re.fullmatch(r'[\w-]+', profile_id) or not os.path.exists(path):
+        raise HTTPException(
+            status_code=404,
+            detail="Profile not found"
+        )
+    with open(path) as profile_file:
+        return profile_file.read()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
-        # Try to initialize the database to make sure it's accessible
-        initialize_database()
+        # Make sure the database is accessible and up to date
+        ensure_database()
         return {
             "status": "healthy",
             "timestamp": datetime.now().isoformat()
@@ -150,7 +368,7 @@ async def health_check():
 @app.on_event("startup")
 async def startup_event():
     try:
-        initialize_database()
+        ensure_database()
         logger.info("API started and database initialized")
     except Exception as e:
         logger.error(f"Failed to initialize database on startup: {str(e)}")
@@ -0,0 +1,57 @@
+"""
+Compression Helpers
+
+Maps compressed file suffixes (.gz, .bz2, .zst) to streaming readers and
+writers so compressed inputs can be downloaded, staged and parsed without a
+decompressed copy ever being written to disk.
+"""
+import io
+import os
+import bz2
+import gzip
+
+COMPRESSION_SUFFIXES = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.zst': 'zstd'
+}
+
+SUFFIX_FOR_COMPRESSION = {compression: suffix for suffix, compression in COMPRESSION_SUFFIXES.items()}
+
+
+def split_compression(path):
+    """Split a path into its uncompressed name and compression type (or None)"""
+    base, ext = os.path.splitext(path)
+    if ext.lower() in COMPRESSION_SUFFIXES:
+        return base, COMPRESSION_SUFFIXES[ext.lower()]
+    return path, None
+
+
+def open_compressed(path, mode='rb', compression=None):
+    """Open a file, transparently (de)compressing it as a stream
+
+    The compression is inferred from the file suffix unless given explicitly.
+    Text modes ('rt'/'wt') return a UTF-8 text stream.
+    """
+    if compression is None:
+        _, compression = split_compression(path)
+
+    if compression is None:
+        if 't' in mode:
+            return open(path, mode.replace('t', ''), encoding='utf-8')
+        return open(path, mode)
+    if compression == 'gzip':
+        return gzip.open(path, mode, encoding='utf-8' if 't' in mode else None)
+    if compression == 'bz2':
+        return bz2.open(path, mode, encoding='utf-8' if 't' in mode else None)
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Reading .zst files requires the 'zstandard' package (pip install zstandard)")
+        if mode == 'rb':
+            # The bare reader has no readline(), which line-based readers need
+            return io.BufferedReader(zstandard.open(path, mode))
+        return zstandard.open(path, mode, encoding='utf-8' if 't' in mode else None)
+
+    raise ValueError(f"Unsupported compression: {compression}")
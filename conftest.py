@@ -0,0 +1,78 @@
+"""
+Shared test setup: the tests run against a throwaway SQLite database
+"""
+import os
+import shutil
+import tempfile
+
+import paramiko
+import pytest
+
+# Set before schema.py creates its engine, so tests never touch data_pipeline.db
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='pipeline-test-'), 'test.db')}"
+
+SAMPLE_CSV = os.path.join(os.path.dirname(__file__), 'sample_data', 'TechCorner_Sales_update.csv')
+
+
+def sample_lines(count, start=0):
+    """The header and ``count`` data lines of the sample CSV, from data line ``start``"""
+    with open(SAMPLE_CSV) as f:
+        lines = f.readlines()
+    return lines[0], lines[1 + start:1 + start + count]
+
+
+def sales_row(customer_id, sale_date, age=30, mobile_name='Galaxy A55 5G 8/128', location='Rangamati Sadar'):
+    """One CSV line in the sample data's format"""
+    return f"{customer_id},{sale_date},{location},{age},F,{mobile_name},15000.0,No,Yes,No,Yes\n"
+
+
+def store_csv(database, path, rows, engine='pandas'):
+    """Write rows to a CSV file, then process and append it"""
+    from process import process_file
+
+    path.write_text(sample_lines(0)[0] + ''.join(rows))
+    data = process_file(str(path), engine=engine)
+    store = database.store_arrow_table if engine == 'arrow' else database.store_dataframe
+    assert store(data, if_exists='append')
+
+
+@pytest.fixture
+def database():
+    """The database module over an empty, initialized test database"""
+    import database
+
+    database.initialize_database()
+    with database.load_transaction() as conn:
+        database._clear_tables(conn)
+        database.refresh_processed_data_view(conn)
+    return database
+
+
+class FakeSFTP:
+    """A local directory served through the SFTPClient calls the ingest code makes"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def listdir_attr(self, remote_dir):
+        return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(self.root, name)), filename=name)
+                for name in sorted(os.listdir(self.root))]
+
+    def get(self, remote_path, local_path):
+        shutil.copy(os.path.join(self.root, os.path.basename(remote_path)), local_path)
+
+    def open(self, remote_path, mode):
+        return open(os.path.join(self.root, os.path.basename(remote_path)), mode)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def sftp_config(tmp_path, monkeypatch):
+    remote_dir = tmp_path / 'remote'
+    remote_dir.mkdir()
+    monkeypatch.setattr('ingest.connect_sftp', lambda *args: FakeSFTP(str(remote_dir)))
+    monkeypatch.setattr('watch.connect_sftp', lambda *args: FakeSFTP(str(remote_dir)))
+    return {'host': 'sftp', 'port': 22, 'username': 'user', 'password': 'secret',
+            'remote_dir': str(remote_dir), 'local_dir': str(tmp_path / 'local')}
@@ -1,61 +1,622 @@
 """
 Database Operations Module
+
+Write path for the sales data: schema creation and migrations, dictionary
+encoding into the dimension tables, routing facts to their monthly
+partitions, zone maps, retention and transactional loads. The table
+definitions live in schema.py and the read path in query.py; their public
+names are re-exported here for existing callers.
 """
 import logging
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Float, DateTime
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
+from sqlalchemy import text, select, func, inspect
 import pandas as pd
-import os
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from schema import (
+    DATABASE_URL, DATABASE_FILE, engine, Base, Session,
+    Load, SalesFact, FactPartition, ZoneMap, CustomerSummary, LoadedFile, AppliedTask,
+    UNDATED_PARTITION, FACT_COLUMNS, DIMENSION_COLUMNS, ENGAGEMENT_COLUMNS, SEARCH_COLUMNS,
+    search_table, partition_name, partition_period, partition_table, customer_index, list_partitions,
+    processed_data_sql, schema_is_current, _as_datetime, _partitions_missing_zone_maps,
+    _partitions_missing_customer_index
+)
+from query import get_data, get_data_batch, get_customer, candidate_id_ranges
+from zonemap import CHUNK_ROWS, compute_zone_map, merge_zone_maps
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Database connection string
+# Fact columns the zone maps are computed from
+ZONE_MAP_COLUMNS = ['id', 'date', 'age', 'sell_price', 'mobile_name_id', 'customer_location_id']
+
+# Fact columns the customer summaries are computed from
+ENGAGEMENT_KEY_COLUMNS = [f"{column}_id" for column in ENGAGEMENT_COLUMNS]
+SUMMARY_FACT_COLUMNS = ['id', 'customer_id', 'date', 'sell_price'] + ENGAGEMENT_KEY_COLUMNS
+
+# Customer ids per IN (...) list, well below SQLite's bound parameter limit
+CUSTOMER_BATCH = 500
+
+# Connection info key for the partitions the current load has written
+LOADED_PARTITIONS = 'loaded_partitions'
 
-DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///data_pipeline.db')
+# Column naming the distributed task each row came from, see store_dataframe
+TASK_KEY_COLUMN = 'task_key'
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
-Base = declarative_base()
-Session = sessionmaker(bind=engine)
 
+def _migrate_legacy_table(conn):
+    """Move rows from a pre-normalization processed_data table into sales_fact"""
+    if 'processed_data' in inspect(conn).get_table_names():
+        from process import normalize_column_name, TECHCORNER_COLUMN_MAPPING
+
+        logging.info("Migrating legacy processed_data table to dimension tables")
+        legacy_df = pd.read_sql_table('processed_data', conn)
+        legacy_df.columns = [normalize_column_name(col) for col in legacy_df.columns]
+        legacy_df = legacy_df.rename(columns=TECHCORNER_COLUMN_MAPPING).drop(columns=['id'], errors='ignore')
+        conn.execute(text("DROP TABLE processed_data"))
+        if len(legacy_df):
+            _store_encoded(conn, legacy_df)
+            update_search_index(conn)
+
+
+def _create_trigram_indexes(conn):
+    """On PostgreSQL, let pg_trgm GIN indexes serve ILIKE on the search dimensions"""
+    try:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for column in SEARCH_COLUMNS:
+            table = DIMENSION_COLUMNS[column].__tablename__
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{table}_value_trgm "
+                f"ON {table} USING gin (value gin_trgm_ops)"
+            ))
+    except Exception as e:
+        logging.warning(f"Could not create trigram indexes, substring filters will scan: {str(e)}")
 
-class ProcessedData(Base):
-    """SQLAlchemy model for TechCorner sales data"""
-    __tablename__ = 'processed_data'
 
-    id = Column(Integer, primary_key=True)
-    customer_id = Column(Integer, nullable=True)
-    date = Column(DateTime, nullable=True)
-    customer_location = Column(String, nullable=True)
-    age = Column(Integer, nullable=True)
-    gender = Column(String, nullable=True)
-    mobile_name = Column(String, nullable=True)
-    sell_price = Column(Float, nullable=True)
-    from_facebook = Column(String, nullable=True)
-    followed_page = Column(String, nullable=True)
-    previous_purchase = Column(String, nullable=True)
-    heard_of_shop = Column(String, nullable=True)
-    source_file = Column(String, nullable=False)
-    processed_at = Column(DateTime, default=datetime.now)
+def _migrate_unpartitioned_facts(conn):
+    """Move dated rows out of sales_fact into their monthly partitions"""
+    dated = select(SalesFact.__table__).where(SalesFact.date.isnot(None))
+    if conn.execute(select(func.count()).select_from(dated.subquery())).scalar():
+        logging.info("Moving dated rows from sales_fact into monthly partitions")
+        fact_df = pd.read_sql(dated, conn)
+        conn.execute(SalesFact.__table__.delete().where(SalesFact.date.isnot(None)))
+        conn.execute(ZoneMap.__table__.delete().where(ZoneMap.partition == UNDATED_PARTITION))
+        _reset_partition_stats(conn, UNDATED_PARTITION)
+        _write_fact_frame(conn, fact_df)
+
+
+def _create_customer_indexes(conn):
+    """Add the (customer_id, date) index to partitions created before it existed"""
+    for partition in _partitions_missing_customer_index(conn):
+        logging.info(f"Indexing {partition.name} by customer")
+        customer_index(partition.name).create(conn, checkfirst=True)
+
+
+def refresh_processed_data_view(conn):
+    """(Re)create the processed_data view over the current partitions"""
+    names = [partition.name for partition in list_partitions(conn)]
+    conn.execute(text("DROP VIEW IF EXISTS processed_data"))
+    conn.execute(text(f"CREATE VIEW processed_data AS {processed_data_sql(partitions=names)}"))
+
+
+def _ensure_undated_partition(conn):
+    if conn.execute(select(FactPartition.name).where(FactPartition.name == UNDATED_PARTITION)).first() is None:
+        conn.execute(FactPartition.__table__.insert().values(name=UNDATED_PARTITION, row_count=0))
+        _reset_partition_stats(conn, UNDATED_PARTITION)
 
 
 def initialize_database():
-    """Create database tables if they don't exist"""
+    """Create database tables and the processed_data view if they don't exist
+
+    An up-to-date database is only read, so this is cheap to call from every
+    process; creation and migrations run in a transaction like a load.
+    """
     try:
-        Base.metadata.create_all(engine)
+        with engine.connect() as conn:
+            current = schema_is_current(conn)
+        if not current:
+            with load_transaction() as conn:
+                _migrate_legacy_table(conn)
+                _migrate_unpartitioned_facts(conn)
+                _create_customer_indexes(conn)
+                _backfill_zone_maps(conn)
+                _backfill_customer_summaries(conn)
+                refresh_processed_data_view(conn)
+        if engine.dialect.name == 'postgresql':
+            with engine.begin() as conn:
+                _create_trigram_indexes(conn)
         logging.info("Database initialized successfully")
     except Exception as e:
         logging.error(f"Error initializing database: {str(e)}")
         raise
 
 
-def store_dataframe(df):
-    """Store a pandas DataFrame in the database"""
+@contextmanager
+def load_lock():
+    """Hold the lock that serializes loads into the database file
+
+    A no-op for server databases, and where fcntl is unavailable.
+    """
+    if DATABASE_FILE is None or fcntl is None:
+        yield
+        return
+    with open(f"{DATABASE_FILE}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _verify_loaded_partitions(conn):
+    """Raise if a partition written by this load disagrees with its catalog row"""
+    names = conn.info.pop(LOADED_PARTITIONS, set())
+    for partition in list_partitions(conn):
+        if partition.name in names:
+            row_count = conn.execute(select(func.count()).select_from(partition_table(partition.name))).scalar()
+            if row_count != partition.row_count:
+                raise RuntimeError(f"Partition {partition.name} has {row_count} rows, "
+                                   f"catalog says {partition.row_count}")
+    conn.execute(text("SELECT * FROM processed_data LIMIT 1"))
+
+
+@contextmanager
+def load_transaction():
+    """Yield a connection whose transaction holds a whole load
+
+    Loads run one at a time under load_lock and write the live database in
+    place. SQLite files are in WAL mode, so readers never wait on the load
+    and keep answering from the last committed state until it commits. The
+    partitions the load wrote are checked against the catalog before the
+    commit, so the cost follows the size of the load rather than of the
+    database; any exception rolls the whole load back.
+    """
+    with load_lock(), engine.begin() as conn:
+        conn.info[LOADED_PARTITIONS] = set()
+        Base.metadata.create_all(conn)
+        _ensure_undated_partition(conn)
+        yield conn
+        _verify_loaded_partitions(conn)
+
+
+def update_search_index(conn):
+    """Rebuild the SQLite FTS5 trigram indexes over the search dimensions
+
+    Runs inside the load transaction so the index never disagrees with the
+    dimension tables. Dimensions are small, so a full rebuild is cheap.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
     try:
-        df.to_sql('processed_data', engine, if_exists='replace', index=False)
+        for column in SEARCH_COLUMNS:
+            table = DIMENSION_COLUMNS[column].__tablename__
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {search_table(column)} USING fts5("
+                f"value, content='{table}', content_rowid='id', tokenize='trigram')"
+            ))
+            conn.execute(text(f"INSERT INTO {search_table(column)}({search_table(column)}) VALUES ('rebuild')"))
+        logging.info("Search index updated")
+    except Exception as e:
+        # A stale index would return wrong results, so fall back to scans
+        logging.warning(f"Could not update search index, substring filters will scan: {str(e)}")
+        for column in SEARCH_COLUMNS:
+            conn.execute(text(f"DROP TABLE IF EXISTS {search_table(column)}"))
+
+
+def _encode_dimension(conn, model, values):
+    """Return a {value: id} mapping for a dimension, inserting any new values"""
+    # Dimension tables are small, so read them whole
+    keys = dict(conn.execute(select(model.value, model.id)).all())
+    missing = {str(value) for value in values if value is not None} - keys.keys()
+    if missing:
+        conn.execute(model.__table__.insert(), [{'value': value} for value in sorted(missing)])
+        keys = dict(conn.execute(select(model.value, model.id)).all())
+    return keys
+
+
+def _insert_load(conn, source_file, processed_at):
+    result = conn.execute(Load.__table__.insert().values(source_file=source_file, processed_at=processed_at))
+    return result.inserted_primary_key[0]
+
+
+def _clear_tables(conn):
+    """Empty the fact and dimension tables for a full reload"""
+    for partition in list_partitions(conn):
+        if partition.name != UNDATED_PARTITION:
+            _drop_partition(conn, partition.name)
+    conn.execute(SalesFact.__table__.delete())
+    _reset_partition_stats(conn, UNDATED_PARTITION)
+    conn.execute(ZoneMap.__table__.delete())
+    conn.execute(CustomerSummary.__table__.delete())
+    conn.execute(AppliedTask.__table__.delete())
+    conn.execute(LoadedFile.__table__.delete())
+    conn.execute(Load.__table__.delete())
+    for model in set(DIMENSION_COLUMNS.values()):
+        conn.execute(model.__table__.delete())
+
+
+def _reset_partition_stats(conn, name):
+    """Recompute a partition's catalog statistics from its table"""
+    table = partition_table(name)
+    row_count, min_id, max_id = conn.execute(
+        select(func.count(), func.min(table.c.id), func.max(table.c.id))
+    ).one()
+    conn.execute(FactPartition.__table__.update().where(FactPartition.name == name).values(
+        row_count=row_count, min_id=min_id, max_id=max_id
+    ))
+
+
+def _drop_partition(conn, name):
+    partition_table(name).drop(conn, checkfirst=True)
+    conn.execute(ZoneMap.__table__.delete().where(ZoneMap.partition == name))
+    conn.execute(FactPartition.__table__.delete().where(FactPartition.name == name))
+
+
+def _next_fact_id(conn):
+    """First unused fact id; ids are unique across all partitions"""
+    max_id = conn.execute(select(func.max(FactPartition.max_id))).scalar()
+    return (max_id or 0) + 1
+
+
+def _record_partition_rows(conn, month, ids_min, ids_max, count):
+    """Create the partition for a month key (None = undated) if needed and update its catalog row"""
+    name = partition_name(month) if month else UNDATED_PARTITION
+    partition = conn.execute(select(FactPartition.__table__).where(FactPartition.name == name)).first()
+    if partition is None:
+        partition_table(name).create(conn, checkfirst=True)
+        period_start, period_end = partition_period(month)
+        conn.execute(FactPartition.__table__.insert().values(
+            name=name, period_start=period_start, period_end=period_end,
+            row_count=count, min_id=ids_min, max_id=ids_max
+        ))
+    else:
+        conn.execute(FactPartition.__table__.update().where(FactPartition.name == name).values(
+            row_count=partition.row_count + count,
+            min_id=ids_min if partition.min_id is None else min(partition.min_id, ids_min),
+            max_id=ids_max if partition.max_id is None else max(partition.max_id, ids_max)
+        ))
+    conn.info.setdefault(LOADED_PARTITIONS, set()).add(name)
+    return name
+
+
+def _python_value(value):
+    """Convert numpy scalars and pandas timestamps for the DB driver"""
+    if value is None:
+        return None
+    if hasattr(value, 'to_pydatetime'):
+        return value.to_pydatetime()
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def _write_zone_maps(conn, name, load_id, chunk_columns):
+    """Store chunk zone maps for one load in one partition, plus their file-level merge"""
+    chunk_maps = [compute_zone_map(columns) for columns in chunk_columns]
+    rows = [dict(zone_map, chunk=chunk) for chunk, zone_map in enumerate(chunk_maps)]
+    rows.append(dict(merge_zone_maps(chunk_maps), chunk=None))
+    conn.execute(ZoneMap.__table__.insert(), [
+        {key: _python_value(value) for key, value in dict(row, partition=name, load_id=load_id).items()}
+        for row in rows
+    ])
+
+
+def _write_frame_zone_maps(conn, name, rows):
+    """Zone maps per load for fact rows of one partition held in a DataFrame"""
+    for load_id, load_rows in rows.sort_values('id').groupby('load_id'):
+        chunks = [load_rows.iloc[start:start + CHUNK_ROWS] for start in range(0, len(load_rows), CHUNK_ROWS)]
+        _write_zone_maps(conn, name, int(load_id), [
+            {column: chunk[column].tolist() for column in ZONE_MAP_COLUMNS} for chunk in chunks
+        ])
+
+
+def _backfill_zone_maps(conn):
+    """Compute zone maps for partitions written before zone maps existed"""
+    for partition in _partitions_missing_zone_maps(conn):
+        logging.info(f"Building zone maps for {partition.name}")
+        conn.execute(ZoneMap.__table__.delete().where(ZoneMap.partition == partition.name))
+        fact = partition_table(partition.name)
+        rows = pd.read_sql(select(*[fact.c[column] for column in ZONE_MAP_COLUMNS + ['load_id']]), conn)
+        _write_frame_zone_maps(conn, partition.name, rows)
+
+
+def _purchase_summaries(rows):
+    """One summary row per fact row; ``sequence`` orders purchases made on the same date"""
+    return pd.DataFrame({
+        'customer_id': rows['customer_id'],
+        'first_purchase': pd.to_datetime(rows['date']),
+        'last_purchase': pd.to_datetime(rows['date']),
+        'purchase_count': 1,
+        'total_spend': rows['sell_price'].fillna(0),
+        'sequence': rows['id'],
+        **{column: rows[column] for column in ENGAGEMENT_KEY_COLUMNS}
+    })
+
+
+def _combine_customer_summaries(summaries):
+    """Collapse summary rows to one per customer
+
+    The engagement answers are the last known ones, ordering purchases by
+    date and then sequence; undated purchases count as the oldest.
+    """
+    summaries = summaries.sort_values(['last_purchase', 'sequence'], na_position='first')
+    combined = summaries.groupby('customer_id', sort=False).agg(
+        first_purchase=('first_purchase', 'min'),
+        last_purchase=('last_purchase', 'max'),
+        purchase_count=('purchase_count', 'sum'),
+        total_spend=('total_spend', 'sum'),
+        **{column: (column, 'last') for column in ENGAGEMENT_KEY_COLUMNS}
+    )
+    return combined.reset_index()
+
+
+def _customer_batches(customer_ids):
+    customer_ids = list(customer_ids)
+    return [customer_ids[start:start + CUSTOMER_BATCH] for start in range(0, len(customer_ids), CUSTOMER_BATCH)]
+
+
+def _write_customer_summaries(conn, summaries):
+    """Replace the stored summaries of the customers in ``summaries``"""
+    for batch in _customer_batches(summaries['customer_id']):
+        conn.execute(CustomerSummary.__table__.delete().where(CustomerSummary.customer_id.in_(batch)))
+    columns = [column.name for column in CustomerSummary.__table__.columns]
+    summaries = summaries[columns].astype({column: 'Int64' for column in ENGAGEMENT_KEY_COLUMNS})
+    records = summaries.astype(object).where(summaries.notna(), None).to_dict('records')
+    if records:
+        conn.execute(CustomerSummary.__table__.insert(), [
+            {key: _python_value(value) for key, value in record.items()} for record in records
+        ])
+
+
+def _merge_customer_summaries(conn, summaries):
+    """Fold summary rows of new purchases into the stored summaries"""
+    if summaries.empty:
+        return
+    stored = [
+        pd.read_sql(select(CustomerSummary.__table__).where(CustomerSummary.customer_id.in_(batch)), conn)
+        for batch in _customer_batches(summaries['customer_id'].unique().tolist())
+    ]
+    stored = [frame for frame in stored if len(frame)]
+    if stored:
+        # Stored summaries predate every new purchase
+        summaries = pd.concat([pd.concat(stored).assign(sequence=0), summaries], ignore_index=True)
+    _write_customer_summaries(conn, _combine_customer_summaries(summaries))
+
+
+def _read_purchases(conn, partition, *conditions):
+    fact = partition_table(partition.name)
+    return pd.read_sql(
+        select(*[fact.c[column] for column in SUMMARY_FACT_COLUMNS]).where(fact.c.customer_id.isnot(None), *conditions),
+        conn
+    )
+
+
+def _update_customer_summaries(conn, first_id):
+    """Fold the fact rows of the load that started at ``first_id`` into the customer summaries"""
+    frames = []
+    for partition in list_partitions(conn):
+        if partition.max_id is not None and partition.max_id >= first_id:
+            fact = partition_table(partition.name)
+            frames.append(_read_purchases(conn, partition, fact.c.id >= first_id))
+    frames = [frame for frame in frames if len(frame)]
+    if frames:
+        _merge_customer_summaries(conn, _purchase_summaries(pd.concat(frames, ignore_index=True)))
+
+
+def _refresh_customer_summaries(conn, customer_ids):
+    """Recompute the summaries of ``customer_ids`` from the fact rows that remain"""
+    for batch in _customer_batches(customer_ids):
+        conn.execute(CustomerSummary.__table__.delete().where(CustomerSummary.customer_id.in_(batch)))
+        frames = []
+        for partition in list_partitions(conn):
+            fact = partition_table(partition.name)
+            frames.append(_read_purchases(conn, partition, fact.c.customer_id.in_(batch)))
+        frames = [frame for frame in frames if len(frame)]
+        if frames:
+            purchases = _purchase_summaries(pd.concat(frames, ignore_index=True))
+            _write_customer_summaries(conn, _combine_customer_summaries(purchases))
+
+
+def _backfill_customer_summaries(conn):
+    """Build customer summaries for facts loaded before the summary table existed"""
+    if conn.execute(select(CustomerSummary.customer_id).limit(1)).first() is not None:
+        return
+    for partition in list_partitions(conn):
+        purchases = _read_purchases(conn, partition)
+        if len(purchases):
+            logging.info(f"Building customer summaries from {partition.name}")
+            _merge_customer_summaries(conn, _purchase_summaries(purchases))
+
+
+def _write_fact_frame(conn, fact_df):
+    """Route fact rows to their monthly partitions, assigning ids where missing"""
+    fact_df = fact_df.copy()
+    if 'id' not in fact_df.columns:
+        next_id = _next_fact_id(conn)
+        fact_df.insert(0, 'id', range(next_id, next_id + len(fact_df)))
+
+    months = pd.to_datetime(fact_df['date'], errors='coerce').dt.strftime('%Y%m')
+    for month, rows in fact_df.groupby(months.fillna(''), sort=True):
+        name = _record_partition_rows(conn, month or None, int(rows['id'].min()), int(rows['id'].max()), len(rows))
+        rows.to_sql(name, conn, if_exists='append', index=False)
+        _write_frame_zone_maps(conn, name, rows)
+
+
+def _write_fact_arrow(conn, facts, batch_size):
+    """Route an Arrow table of fact rows to their monthly partitions, assigning ids"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    next_id = _next_fact_id(conn)
+    facts = facts.add_column(0, 'id', pa.array(range(next_id, next_id + facts.num_rows), type=pa.int64()))
+
+    # JSON loads can carry no dates or date strings; those that do not parse go undated
+    dates = facts['date']
+    if pa.types.is_null(dates.type):
+        dates = dates.cast(pa.timestamp('ns'))
+    elif not pa.types.is_timestamp(dates.type):
+        dates = pc.strptime(dates.cast(pa.string()), format='%Y-%m-%d', unit='ns', error_is_null=True)
+    facts = facts.set_column(facts.schema.get_field_index('date'), 'date', dates)
+    months = pc.strftime(dates, format='%Y%m') if facts.num_rows else pa.array([], pa.string())
+    for month in pc.unique(months).to_pylist():
+        mask = pc.is_null(months) if month is None else pc.equal(months, month)
+        rows = facts.filter(mask)
+        name = _record_partition_rows(conn, month, pc.min(rows['id']).as_py(), pc.max(rows['id']).as_py(), rows.num_rows)
+        target = partition_table(name)
+        for batch in rows.to_batches(max_chunksize=batch_size):
+            conn.execute(target.insert(), batch.to_pylist())
+
+        # Zone maps per load, computed from the rows just written
+        for load_id in pc.unique(rows['load_id']).to_pylist():
+            load_rows = rows.filter(pc.equal(rows['load_id'], load_id))
+            chunks = [load_rows.slice(start, CHUNK_ROWS) for start in range(0, load_rows.num_rows, CHUNK_ROWS)]
+            _write_zone_maps(conn, name, load_id, [
+                {column: chunk[column].to_pylist() for column in ZONE_MAP_COLUMNS} for chunk in chunks
+            ])
+
+
+def drop_partitions_before(cutoff):
+    """Drop every monthly partition that ends on or before ``cutoff``
+
+    This is the retention mechanism: whole months are dropped instead of
+    deleting rows. Returns the names of the dropped partitions.
+    """
+    cutoff = _as_datetime(cutoff)
+
+    def expired(conn):
+        return [partition.name for partition in list_partitions(conn)
+                if partition.period_end is not None and partition.period_end <= cutoff]
+
+    # Check without the load lock first so a no-op does not wait on a load
+    with engine.connect() as conn:
+        if not expired(conn):
+            return []
+
+    with load_transaction() as conn:
+        dropped = expired(conn)
+        customer_ids = set()
+        for name in dropped:
+            fact = partition_table(name)
+            customer_ids.update(row[0] for row in conn.execute(
+                select(fact.c.customer_id).where(fact.c.customer_id.isnot(None)).distinct()
+            ))
+            _drop_partition(conn, name)
+        _refresh_customer_summaries(conn, sorted(customer_ids))
+        refresh_processed_data_view(conn)
+    logging.info(f"Dropped partitions: {dropped}")
+    return dropped
+
+
+def drop_expired_partitions(retention_months):
+    """Keep the current month plus ``retention_months`` full months of partitions"""
+    today = datetime.now()
+    months = today.year * 12 + today.month - 1 - retention_months
+    return drop_partitions_before(datetime(months // 12, months % 12 + 1, 1))
+
+
+def _log_dropped_columns(columns):
+    dropped = set(columns) - set(FACT_COLUMNS) - set(DIMENSION_COLUMNS) - {'source_file', 'processed_at', TASK_KEY_COLUMN}
+    if dropped:
+        logging.warning(f"Columns not in the sales schema were not stored: {sorted(dropped)}")
+
+
+def _store_encoded(conn, df):
+    """Dictionary-encode a DataFrame into the dimension tables and append its facts"""
+    _log_dropped_columns(df.columns)
+    fact_df = pd.DataFrame(index=df.index)
+    for column in FACT_COLUMNS:
+        fact_df[column] = df[column] if column in df.columns else None
+
+    for column, model in DIMENSION_COLUMNS.items():
+        if column in df.columns:
+            values = df[column].astype(str)
+            keys = _encode_dimension(conn, model, values.unique())
+            fact_df[f"{column}_id"] = values.map(keys)
+        else:
+            fact_df[f"{column}_id"] = None
+
+    # One load row per (source_file, processed_at) pair, usually one per file
+    if 'source_file' not in df.columns:
+        df = df.assign(source_file='Unknown')
+    if 'processed_at' not in df.columns:
+        df = df.assign(processed_at=datetime.now())
+    load_keys = pd.Series(index=df.index, dtype='Int64')
+    for (source_file, processed_at), group in df.groupby(['source_file', 'processed_at']).groups.items():
+        load_keys[group] = _insert_load(conn, source_file, pd.Timestamp(processed_at).to_pydatetime())
+    fact_df['load_id'] = load_keys
+
+    first_id = _next_fact_id(conn)
+    _write_fact_frame(conn, fact_df)
+    _update_customer_summaries(conn, first_id)
+
+
+def applied_task_keys(task_keys):
+    """The subset of ``task_keys`` whose rows are already stored"""
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(
+            select(AppliedTask.task_key).where(AppliedTask.task_key.in_(list(task_keys)))
+        )}
+
+
+def _record_applied_tasks(conn, task_keys):
+    """Mark tasks as stored in the load transaction; returns the keys stored before
+
+    Loads are serialized, so the keys found here cannot be recorded by
+    another load before this one commits.
+    """
+    if not task_keys:
+        return set()
+    applied = {row[0] for row in conn.execute(
+        select(AppliedTask.task_key).where(AppliedTask.task_key.in_(list(task_keys)))
+    )}
+    if applied:
+        logging.warning(f"Skipping rows of {len(applied)} tasks that were already loaded: {sorted(applied)}")
+    new_keys = [key for key in dict.fromkeys(task_keys) if key not in applied]
+    if new_keys:
+        conn.execute(AppliedTask.__table__.insert(), [{'task_key': key} for key in new_keys])
+    return applied
+
+
+def loaded_files():
+    """Remote files already stored, as {name: LoadedFile row}"""
+    with engine.connect() as conn:
+        return {row.name: row for row in conn.execute(select(LoadedFile.__table__))}
+
+
+def _record_loaded_files(conn, files):
+    """Record remote files (dicts of LoadedFile columns) as stored by this load"""
+    if not files:
+        return
+    conn.execute(LoadedFile.__table__.delete().where(LoadedFile.name.in_([file['name'] for file in files])))
+    conn.execute(LoadedFile.__table__.insert(), [dict(file, loaded_at=datetime.now()) for file in files])
+
+
+def store_dataframe(df, if_exists='replace', task_keys=None, files=None):
+    """Store a pandas DataFrame in the database
+
+    ``if_exists='append'`` adds the rows to the existing data, which is what
+    incremental loads use; the default replaces all data as a full reload.
+    ``task_keys`` names the distributed tasks the rows came from, and each
+    row names its task in a task_key column; rows of tasks that were loaded
+    before are skipped and the rest are stored. ``files`` lists the remote files the rows came from, recorded in
+    loaded_file in the same transaction.
+    """
+    try:
+        with load_transaction() as conn:
+            if if_exists == 'replace':
+                _clear_tables(conn)
+            applied = _record_applied_tasks(conn, task_keys)
+            if applied:
+                df = df[~df[TASK_KEY_COLUMN].isin(applied)]
+            _record_loaded_files(conn, files)
+            _store_encoded(conn, df.drop(columns=[TASK_KEY_COLUMN], errors='ignore'))
+            update_search_index(conn)
+            refresh_processed_data_view(conn)
         logging.info(f"Stored {len(df)} rows in the database")
         return True
     except Exception as e:
@@ -63,112 +624,88 @@ def store_dataframe(df):
         return False
 
 
-def get_data(start_date=None, end_date=None, location=None, gender=None, 
-           min_age=None, max_age=None, mobile_name=None, cursor=None, limit=50):
-    """Retrieve TechCorner sales data with optional filtering and pagination"""
-    try:
-        logging.info(f"get_data called with params: start_date={start_date}, end_date={end_date}, "
-                    f"location={location}, gender={gender}, min_age={min_age}, max_age={max_age}, "
-                    f"mobile_name={mobile_name}, cursor={cursor}, limit={limit}")
+def _encode_arrow_column(conn, model, column):
+    """Map an Arrow string column to dimension keys via its dictionary"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
 
-        # Print table columns for debugging
-        try:
-            from sqlalchemy import inspect
-            inspector = inspect(engine)
-            columns = inspector.get_columns('processed_data')
-            column_names = [col['name'] for col in columns]
-            logging.info(f"Database table columns: {column_names}")
-        except Exception as e:
-            logging.error(f"Error getting column names: {str(e)}")
+    if not pa.types.is_dictionary(column.type):
+        column = column.cast(pa.string()).dictionary_encode()
 
-        session = Session()
+    chunks = []
+    for chunk in column.chunks:
+        # Look up each dictionary entry once, then gather by index
+        dictionary = [None if value is None else str(value) for value in chunk.dictionary.to_pylist()]
+        keys = _encode_dimension(conn, model, dictionary)
+        dictionary_keys = pa.array([keys.get(value) for value in dictionary], type=pa.int64())
+        chunks.append(pc.take(dictionary_keys, chunk.indices))
+    return pa.chunked_array(chunks, type=pa.int64())
 
-        try:
-            # Base query
-            query = session.query(ProcessedData)
-
-            # Apply date filters
-            if start_date:
-                query = query.filter(ProcessedData.date >= start_date)
-            if end_date:
-                query = query.filter(ProcessedData.date <= end_date)
-
-            # Apply customer demographic filters
-            if location:
-                query = query.filter(ProcessedData.customer_location.ilike(f"%{location}%"))
-            if gender:
-                query = query.filter(ProcessedData.gender == gender)
-            if min_age is not None:
-                query = query.filter(ProcessedData.age >= min_age)
-            if max_age is not None:
-                query = query.filter(ProcessedData.age <= max_age)
-
-            # Apply product filter
-            if mobile_name:
-                query = query.filter(ProcessedData.mobile_name.ilike(f"%{mobile_name}%"))
-
-            # Apply cursor-based pagination
-            if cursor:
-                query = query.filter(ProcessedData.id > int(cursor))
-
-            # Apply ordering and limit
-            query = query.order_by(ProcessedData.id)
-            query = query.limit(limit + 1)  # +1 to check if there are more results
-
-            # Execute query
-            results = query.all()
-
-            # Check if there are more results
-            has_more = len(results) > limit
-            data = results[:limit]
-
-            # Generate next cursor
-            next_cursor = str(data[-1].id) if has_more and data else None
-
-            # Convert to dictionaries
-            data_dicts = []
-            for item in data:
-                item_dict = {}
-                for column in item.__table__.columns:
-                    value = getattr(item, column.name)
-                    # Convert datetime objects to ISO format strings
-                    if isinstance(value, datetime):
-                        value = value.isoformat()
-                    item_dict[column.name] = value
-                data_dicts.append(item_dict)
-
-            # Count total matching records
-            total_count_query = session.query(ProcessedData)
-            if start_date:
-                total_count_query = total_count_query.filter(ProcessedData.date >= start_date)
-            if end_date:
-                total_count_query = total_count_query.filter(ProcessedData.date <= end_date)
-            if location:
-                total_count_query = total_count_query.filter(ProcessedData.customer_location.ilike(f"%{location}%"))
-            if gender:
-                total_count_query = total_count_query.filter(ProcessedData.gender == gender)
-            if min_age is not None:
-                total_count_query = total_count_query.filter(ProcessedData.age >= min_age)
-            if max_age is not None:
-                total_count_query = total_count_query.filter(ProcessedData.age <= max_age)
-            if mobile_name:
-                total_count_query = total_count_query.filter(ProcessedData.mobile_name.ilike(f"%{mobile_name}%"))
-
-            total_count = total_count_query.count()
-
-            return {
-                "items": data_dicts,
-                "next_cursor": next_cursor,
-                "total_count": total_count
-            }
-        except Exception as e:
-            logging.error(f"Error in query execution: {str(e)}")
-            return None
-        finally:
-            session.close()
+
+def store_arrow_table(table, if_exists='replace', batch_size=10000, task_keys=None, files=None):
+    """Store a pyarrow Table in the database
+
+    Dictionary-encoded columns are mapped to dimension keys by looking up
+    each dictionary entry once, and the fact record batches are inserted
+    directly through SQLAlchemy without building a pandas DataFrame;
+    ``if_exists``, ``task_keys`` and ``files`` behave as in store_dataframe.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        _log_dropped_columns(table.column_names)
+
+        with load_transaction() as conn:
+            if if_exists == 'replace':
+                _clear_tables(conn)
+            applied = _record_applied_tasks(conn, task_keys)
+            if applied:
+                table = table.filter(pc.invert(pc.is_in(table[TASK_KEY_COLUMN].cast(pa.string()),
+                                                        value_set=pa.array(sorted(applied)))))
+            _record_loaded_files(conn, files)
+            num_rows = table.num_rows
+
+            columns = {}
+            for column in FACT_COLUMNS:
+                if column in table.column_names:
+                    columns[column] = table[column]
+                elif column == 'date':
+                    columns[column] = pa.nulls(num_rows, type=pa.timestamp('ns'))
+                else:
+                    columns[column] = pa.nulls(num_rows)
+            for column, model in DIMENSION_COLUMNS.items():
+                if column in table.column_names:
+                    columns[f"{column}_id"] = _encode_arrow_column(conn, model, table[column])
+                else:
+                    columns[f"{column}_id"] = pa.nulls(num_rows, type=pa.int64())
+
+            # One load row per (source_file, processed_at) pair, usually one per file
+            load_keys = pa.nulls(num_rows, type=pa.int64())
+            # Files combined into one table carry differing dictionaries, which group_by cannot unify
+            pairs = pa.table({
+                'source_file': table['source_file'].cast(pa.string()),
+                'processed_at': table['processed_at']
+            }).group_by(['source_file', 'processed_at']).aggregate([])
+            for pair in pairs.to_pylist():
+                load_id = _insert_load(conn, pair['source_file'], pair['processed_at'])
+                mask = pc.and_(pc.equal(table['source_file'].cast(pa.string()), pair['source_file']),
+                               pc.equal(table['processed_at'], pa.scalar(pair['processed_at'], type=table['processed_at'].type)))
+                load_keys = pc.if_else(mask, load_id, load_keys)
+            columns['load_id'] = load_keys
+
+            first_id = _next_fact_id(conn)
+            _write_fact_arrow(conn, pa.table(columns), batch_size)
+            _update_customer_summaries(conn, first_id)
+
+            update_search_index(conn)
+            refresh_processed_data_view(conn)
+
+        logging.info(f"Stored {num_rows} rows in the database")
+        return True
     except Exception as e:
-        logging.error(f"Error retrieving data from database: {str(e)}")
-        return None
+        logging.error(f"Error storing data in database: {str(e)}")
+        return False
 
 
 # For testing
@@ -198,4 +735,4 @@ if __name__ == "__main__":
 
     # Retrieve data
     result = get_data()
-    print("Retrieved data:", result)
\ No newline at end of file
+    print("Retrieved data:", result)
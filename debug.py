@@ -5,10 +5,10 @@ import sqlite3
 conn = sqlite3.connect('data_pipeline.db')
 cursor = conn.cursor()
 
-# Check if the table exists
-cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+# Check if the table exists; processed_data is a view over the star schema
+cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view');")
 tables = cursor.fetchall()
-print(f"Tables in database: {tables}")
+print(f"Tables and views in database: {tables}")
 
 # If processed_data exists, check its structure and sample data
 if ('processed_data',) in tables:
@@ -34,6 +34,6 @@ if ('processed_data',) in tables:
     else:
         print("\nNo data in table.")
 else:
-    print("\nprocessed_data table does not exist.")
+    print("\nprocessed_data view does not exist.")
 
 conn.close()
\ No newline at end of file
@@ -0,0 +1,389 @@
+"""
+Distributed Processing Module
+
+Spreads processing and loading over several worker processes, possibly on
+several hosts that share storage. A coordinator downloads new or grown files
+and puts each one, or each byte range of records of a large CSV file, into a
+durable task queue kept in a SQLite file. Workers lease batches of tasks,
+process them with the usual cleaning logic and load the results. Leases expire when a worker dies so
+another worker retries the task, and every load records its task keys in
+the same transaction, so a retried task is never loaded twice.
+"""
+import os
+import time
+import signal
+import socket
+import sqlite3
+import logging
+import threading
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+
+from compression import split_compression
+
+logger = logging.getLogger(__name__)
+
+TASK_QUEUE_PATH = os.getenv('TASK_QUEUE_PATH', './task_queue.db')
+
+# Task states
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class TaskQueue:
+    """Durable task queue in a SQLite file
+
+    Every operation opens its own short-lived connection, so a queue can be
+    shared between threads, processes and (with working POSIX locks on the
+    shared filesystem) hosts.
+    """
+
+    def __init__(self, path=TASK_QUEUE_PATH, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id INTEGER PRIMARY KEY,
+                    task_key TEXT NOT NULL UNIQUE,
+                    file_name TEXT,
+                    file_path TEXT NOT NULL,
+                    start_byte INTEGER,
+                    end_byte INTEGER,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_tasks_status ON tasks (status, lease_expires)")
+            # Remote files queued so far, with the number of their records queued
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS queued_file (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    row_count INTEGER,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return closing(conn)
+
+    def enqueue(self, task_key, file_path, start_byte=None, end_byte=None, file_name=None):
+        """Add a task unless one with the same key exists; returns True if added"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO tasks (task_key, file_name, file_path, start_byte, end_byte, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (task_key, file_name, file_path, start_byte, end_byte, now, now)
+            )
+            return cursor.rowcount == 1
+
+    def record_file(self, name, size, mtime, row_count=None):
+        """Remember that a remote file's records up to ``row_count`` are queued"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO queued_file (name, size, mtime, row_count, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (name, size, mtime, row_count, time.time())
+            )
+
+    def queued_files(self):
+        """Remote files queued so far, as {name: (size, mtime, row_count)}"""
+        with self._connect() as conn:
+            return {row['name']: (row['size'], row['mtime'], row['row_count'])
+                    for row in conn.execute("SELECT name, size, mtime, row_count FROM queued_file")}
+
+    def unfinished_files(self):
+        """Names of the remote files that still have pending or leased tasks"""
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute(
+                "SELECT DISTINCT file_name FROM tasks WHERE status IN (?, ?) AND file_name IS NOT NULL",
+                (PENDING, LEASED)
+            )}
+
+    def lease(self, owner, count=1, lease_seconds=300):
+        """Lease up to ``count`` pending tasks, or tasks whose lease expired"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Give up on tasks that expired too often, e.g. because they crash workers
+                conn.execute(
+                    "UPDATE tasks SET status = ?, last_error = 'lease expired', updated_at = ? "
+                    "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                    (FAILED, now, LEASED, now, self.max_attempts)
+                )
+                rows = conn.execute(
+                    "SELECT * FROM tasks WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                    "ORDER BY id LIMIT ?",
+                    (PENDING, LEASED, now, count)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE tasks SET status = ?, lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    [(LEASED, owner, now + lease_seconds, now, row['id']) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return [dict(row) for row in rows]
+
+    def extend(self, task_ids, owner, lease_seconds=300):
+        """Renew the leases ``owner`` still holds"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                [(now + lease_seconds, now, task_id, owner, LEASED) for task_id in task_ids]
+            )
+
+    def complete(self, task_ids, owner):
+        """Mark tasks done; ignored for tasks whose lease moved to another worker"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE tasks SET status = ?, lease_owner = NULL, lease_expires = NULL, last_error = NULL, "
+                "updated_at = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                [(DONE, now, task_id, owner, LEASED) for task_id in task_ids]
+            )
+
+    def fail(self, task_ids, owner, error):
+        """Release tasks for a retry, or mark them failed after max_attempts"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                "lease_owner = NULL, lease_expires = NULL, last_error = ?, updated_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = ?",
+                [(self.max_attempts, FAILED, PENDING, error, now, task_id, owner, LEASED) for task_id in task_ids]
+            )
+
+    def counts(self):
+        """Number of tasks in each state"""
+        with self._connect() as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in (PENDING, LEASED, DONE, FAILED)}
+
+
+def task_key(name, size, mtime, start_byte=None, end_byte=None):
+    """Stable key for a remote file or chunk; a changed file gets new keys
+
+    ``size`` and ``mtime`` are those of the remote file, which downloading it
+    again does not change.
+    """
+    key = f"{name}:{size}:{int(mtime)}"
+    if start_byte is not None:
+        key += f":{start_byte}-{end_byte}"
+    return key
+
+
+def enqueue_file(queue, file_path, name, size, mtime, chunk_rows=None, skip_rows=0):
+    """Coordinator step: queue the records of a downloaded file after the first ``skip_rows``
+
+    ``name``, ``size`` and ``mtime`` describe the remote file. CSV files are
+    queued as byte ranges of whole records, so workers seek straight to them:
+    chunks of ``chunk_rows`` records for uncompressed files, and a single
+    range for compressed ones, since reaching an offset in them means
+    decompressing everything before it. Re-queuing the same file is a no-op.
+    Returns the number of new tasks.
+    """
+    from process import csv_record_ranges
+
+    file_path = os.path.abspath(file_path)
+    base_name, compression = split_compression(file_path)
+    added = 0
+    if base_name.endswith('.csv'):
+        ranges = csv_record_ranges(file_path, chunk_rows if compression is None else None, skip_rows)
+        for start_byte, end_byte, _ in ranges:
+            added += queue.enqueue(task_key(name, size, mtime, start_byte, end_byte), file_path,
+                                   start_byte, end_byte, file_name=name)
+        row_count = skip_rows + sum(rows for _, _, rows in ranges)
+    else:
+        added += queue.enqueue(task_key(name, size, mtime), file_path, file_name=name)
+        row_count = None
+    queue.record_file(name, size, mtime, row_count)
+    return added
+
+
+class Worker:
+    """Lease, process and load batches of tasks until the queue is drained or stopped"""
+
+    def __init__(self, queue, engine='pandas', batch_size=4, lease_seconds=300, poll_interval=5.0,
+                 max_workers=2, worker_id=None):
+        self.queue = queue
+        self.engine = engine
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_workers = max_workers
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop_event = threading.Event()
+
+    def stop(self, *_):
+        self._stop_event.set()
+
+    def _heartbeat(self, task_ids, done):
+        """Keep the batch's leases alive while it is processed and loaded"""
+        while not done.wait(self.lease_seconds / 3):
+            self.queue.extend(task_ids, self.worker_id, self.lease_seconds)
+
+    def run_batch(self, tasks):
+        """Process and load one batch of leased tasks; returns rows stored"""
+        from process import process_file, combine_results
+        from database import TASK_KEY_COLUMN, applied_task_keys, store_dataframe, store_arrow_table
+
+        task_ids = [task['id'] for task in tasks]
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task_ids, done), daemon=True)
+        heartbeat.start()
+        try:
+            # A previous attempt may have loaded some tasks before its lease expired
+            applied = applied_task_keys([task['task_key'] for task in tasks])
+            if applied:
+                logger.info(f"Skipping {len(applied)} tasks that were already loaded")
+                self.queue.complete([task['id'] for task in tasks if task['task_key'] in applied], self.worker_id)
+                tasks = [task for task in tasks if task['task_key'] not in applied]
+            if not tasks:
+                return 0
+
+            def process_task(task):
+                byte_range = (task['start_byte'], task['end_byte']) if task['start_byte'] is not None else None
+                result = process_file(task['file_path'], engine=self.engine, byte_range=byte_range)
+                if result is None:
+                    return None
+                # Name each row's task, so the load can skip tasks another worker already loaded
+                if self.engine == 'arrow':
+                    import pyarrow as pa
+                    keys = pa.array([task['task_key']] * result.num_rows, type=pa.string())
+                    return result.append_column(TASK_KEY_COLUMN, keys)
+                return result.assign(**{TASK_KEY_COLUMN: task['task_key']})
+
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(process_task, tasks))
+
+            failed = [task for task, result in zip(tasks, results) if result is None]
+            if failed:
+                self.queue.fail([task['id'] for task in failed], self.worker_id, "processing failed")
+            loaded = [(task, result) for task, result in zip(tasks, results) if result is not None]
+            if not loaded:
+                return 0
+
+            combined = combine_results([result for _, result in loaded], self.engine)
+            store = store_arrow_table if self.engine == 'arrow' else store_dataframe
+            if not store(combined, if_exists='append', task_keys=[task['task_key'] for task, _ in loaded]):
+                self.queue.fail([task['id'] for task, _ in loaded], self.worker_id, "load failed")
+                return 0
+
+            # Tasks the load skipped were loaded by an earlier attempt, so they are done too
+            self.queue.complete([task['id'] for task, _ in loaded], self.worker_id)
+            logger.info(f"Worker {self.worker_id} loaded {len(combined)} rows from {len(loaded)} tasks")
+            return len(combined)
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def run(self, exit_when_empty=False):
+        """Work until stopped, or until no task is pending or leased with ``exit_when_empty``"""
+        logger.info(f"Worker {self.worker_id} started")
+        total_rows = 0
+        while not self._stop_event.is_set():
+            tasks = self.queue.lease(self.worker_id, self.batch_size, self.lease_seconds)
+            if tasks:
+                try:
+                    total_rows += self.run_batch(tasks)
+                except Exception as e:
+                    logger.error(f"Worker {self.worker_id} batch failed: {str(e)}")
+                    self.queue.fail([task['id'] for task in tasks], self.worker_id, str(e))
+                continue
+
+            counts = self.queue.counts()
+            if exit_when_empty and counts[PENDING] == 0 and counts[LEASED] == 0:
+                break
+            self._stop_event.wait(self.poll_interval)
+        logger.info(f"Worker {self.worker_id} stopped after loading {total_rows} rows")
+        return total_rows
+
+
+def run_coordinator(sftp_config, queue_path=TASK_QUEUE_PATH, chunk_rows=None):
+    """Download new or grown files from SFTP and queue them for the workers
+
+    Files queued before, or loaded by the pipeline or watch mode, are skipped
+    while the remote file is unchanged. Of a CSV file that grew only the new
+    records are queued; any other change is logged and skipped, since the
+    earlier rows are already loaded. A file is not downloaded again while
+    it still has unfinished tasks, which read its local copy.
+    """
+    from ingest import ingest_data, local_path_for
+    from database import initialize_database, loaded_files
+
+    initialize_database()
+    queue = TaskQueue(queue_path)
+    known = {name: (row.size, row.mtime, row.row_count) for name, row in loaded_files().items()}
+    known.update(queue.queued_files())
+    seen = {name: (size, mtime) for name, (size, mtime, _) in known.items()}
+    ingest_data(sftp_config, seen=seen, exclude=queue.unfinished_files())
+
+    added = 0
+    for name, (size, mtime) in seen.items():
+        if name not in known:
+            skip_rows = 0
+        elif known[name][:2] == (size, mtime):
+            continue
+        else:
+            base_name, _ = split_compression(name)
+            if not base_name.endswith('.csv') or known[name][2] is None or size < known[name][0]:
+                logger.warning(f"{name} changed in place; only rows appended to CSV files are queued, skipping it")
+                queue.record_file(name, size, mtime, known[name][2])
+                continue
+            skip_rows = known[name][2]
+        local_path = local_path_for(name, sftp_config['local_dir'], sftp_config.get('staging_compression'))
+        added += enqueue_file(queue, local_path, name, size, mtime, chunk_rows, skip_rows)
+
+    logger.info(f"Queued {added} new tasks; task queue: {queue.counts()}")
+    return added
+
+
+def _run_worker_process(queue_path, engine, batch_size, lease_seconds, exit_when_empty):
+    from database import initialize_database
+
+    worker = Worker(TaskQueue(queue_path), engine=engine, batch_size=batch_size, lease_seconds=lease_seconds)
+    # Finish the current batch before exiting
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    initialize_database()
+    worker.run(exit_when_empty=exit_when_empty)
+
+
+def run_workers(queue_path=TASK_QUEUE_PATH, processes=1, engine='pandas', batch_size=4, lease_seconds=300,
+                exit_when_empty=False):
+    """Run ``processes`` worker processes on this host until they finish"""
+    import multiprocessing
+
+    args = (queue_path, engine, batch_size, lease_seconds, exit_when_empty)
+    if processes == 1:
+        _run_worker_process(*args)
+        return
+
+    workers = [multiprocessing.Process(target=_run_worker_process, args=args) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+        for worker in workers:
+            worker.join()
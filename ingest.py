@@ -2,9 +2,12 @@
 SFTP Data Ingestion Module
 """
 import os
+import shutil
 import paramiko
 import logging
 
+from compression import split_compression, open_compressed, SUFFIX_FOR_COMPRESSION
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -23,24 +26,71 @@ def connect_sftp(host, port, username, password):
         return None
 
 
-def download_files(sftp, remote_dir, local_dir):
-    """Download files from SFTP server to local directory"""
+def is_supported_file(filename):
+    """Check whether a remote file is one the pipeline can process"""
+    base_name, _ = split_compression(filename)
+    return base_name.endswith('.csv') or base_name.endswith('.json')
+
+
+def local_path_for(filename, local_dir, staging_compression=None):
+    """Local staging path for a remote file
+
+    Files that arrive uncompressed are staged with ``staging_compression``
+    applied, if set; already compressed files are always kept as they are.
+    """
+    local_path = f"{local_dir}/{filename}"
+    _, compression = split_compression(filename)
+    if staging_compression and compression is None:
+        local_path += SUFFIX_FOR_COMPRESSION[staging_compression]
+    return local_path
+
+
+def download_files(sftp, remote_dir, local_dir, seen=None, staging_compression=None, exclude=None):
+    """Download files from SFTP server to local directory
+
+    When ``seen`` is given it maps filenames to the (size, mtime) last
+    downloaded; unchanged files are skipped and the mapping is updated, so
+    repeated calls only pick up new or modified files. Filenames in
+    ``exclude`` are not downloaded this time, e.g. while their local copy
+    is still in use.
+
+    Compressed files are transferred as-is. With ``staging_compression``
+    ('gzip', 'bz2' or 'zstd'), uncompressed files are compressed as they
+    stream in so the local staging area stays compressed too.
+    """
     try:
         os.makedirs(local_dir, exist_ok=True)
         
         # List files in remote directory
-        files = sftp.listdir(remote_dir)
+        files = sftp.listdir_attr(remote_dir)
         downloaded_files = []
         
-        for filename in files:
-            if filename.endswith('.csv') or filename.endswith('.json'):
+        for attr in files:
+            filename = attr.filename
+            if is_supported_file(filename):
                 remote_path = f"{remote_dir}/{filename}"
-                local_path = f"{local_dir}/{filename}"
+                local_path = local_path_for(filename, local_dir, staging_compression)
+                signature = (attr.st_size, attr.st_mtime)
+
+                if seen is not None and seen.get(filename) == signature:
+                    continue
+                if exclude and filename in exclude:
+                    logging.info(f"Not downloading {filename} yet, its local copy is still in use")
+                    continue
                 
                 # Download file
-                sftp.get(remote_path, local_path)
+                if local_path.endswith(filename):
+                    sftp.get(remote_path, local_path)
+                else:
+                    with sftp.open(remote_path, 'rb') as remote_file:
+                        remote_file.prefetch()
+                        with open_compressed(local_path, 'wb', staging_compression) as local_file:
+                            shutil.copyfileobj(remote_file, local_file, 1024 * 1024)
                 logging.info(f"Downloaded {filename}")
                 downloaded_files.append(local_path)
+
+                if seen is not None:
+                    seen[filename] = signature
         
         return downloaded_files
     except Exception as e:
@@ -48,8 +98,12 @@ def download_files(sftp, remote_dir, local_dir):
         return []
 
 
-def ingest_data(config):
-    """Main function to ingest data from SFTP"""
+def ingest_data(config, seen=None, exclude=None):
+    """Main function to ingest data from SFTP
+
+    ``seen`` and ``exclude`` are passed on to download_files, which fills in
+    the (size, mtime) of each downloaded file.
+    """
     sftp = connect_sftp(
         config['host'],
         config['port'],
@@ -59,7 +113,8 @@ def ingest_data(config):
 
     if sftp:
         try:
-            files = download_files(sftp, config['remote_dir'], config['local_dir'])
+            files = download_files(sftp, config['remote_dir'], config['local_dir'], seen=seen,
+                                   staging_compression=config.get('staging_compression'), exclude=exclude)
             sftp.close()
             return files
         except Exception as e:
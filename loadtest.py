@@ -0,0 +1,334 @@
+"""
+Load Testing Module
+
+Replays a realistic mix of /data queries against api.py and/or simple_api.py
+with concurrent asyncio clients, and reports throughput and latency
+percentiles per API and query shape. Results can be saved as a baseline and
+later runs compared against it to flag regressions. Uses only the standard
+library; each API is started under uvicorn on a free local port unless --url
+points at a running server.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import random
+import asyncio
+import logging
+import argparse
+import subprocess
+import urllib.request
+from urllib.parse import urlencode, urlsplit
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TARGETS = {
+    'api': 'api:app',
+    'simple_api': 'simple_api:app'
+}
+
+API_KEYS = ['test_api_key', 'demo_key']
+
+# Filter values that occur in the TechCorner dataset
+LOCATIONS = ['Rangamati Sadar', 'Inside Rangamati', 'Outside Rangamati', 'Ranga']
+GENDERS = ['M', 'F']
+MOBILE_NAMES = ['iPhone', 'Galaxy', 'Redmi', 'Pixel', 'Vivo', 'iQOO', 'Note 14 Pro']
+MONTHS = ['2024-05', '2024-06', '2024-07', '2024-08', '2024-09', '2024-10', '2024-11', '2024-12', '2025-01']
+
+# Pages followed per cursor walk
+CURSOR_WALK_PAGES = 5
+
+
+def _month_range(rng):
+    month = rng.choice(MONTHS)
+    return {'start_date': f"{month}-01", 'end_date': f"{month}-28"}
+
+
+# Query shapes and their share of the mix; each returns /data parameters
+QUERY_SHAPES = {
+    'unfiltered': (0.15, lambda rng: {}),
+    'date_range': (0.20, _month_range),
+    'location': (0.15, lambda rng: {'location': rng.choice(LOCATIONS)}),
+    'gender_age': (0.15, lambda rng: {'gender': rng.choice(GENDERS), 'min_age': rng.randint(18, 30),
+                                      'max_age': rng.randint(31, 50)}),
+    'mobile_name': (0.15, lambda rng: {'mobile_name': rng.choice(MOBILE_NAMES)}),
+    'combined': (0.10, lambda rng: dict(_month_range(rng), location=rng.choice(LOCATIONS),
+                                        mobile_name=rng.choice(MOBILE_NAMES))),
+    'cursor_walk': (0.10, lambda rng: {'gender': rng.choice(GENDERS)})
+}
+
+
+class HTTPClient:
+    """Minimal keep-alive HTTP/1.1 client over asyncio streams"""
+
+    def __init__(self, host, port, headers=None):
+        self.host = host
+        self.port = port
+        self.headers = headers or {}
+        self._reader = None
+        self._writer = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
+
+    async def get(self, path):
+        """GET ``path``; returns (status, body bytes)"""
+        for attempt in range(2):
+            if self._writer is None:
+                await self._connect()
+            try:
+                return await self._request(path)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server closed an idle keep-alive connection; reconnect once
+                await self.close()
+                if attempt:
+                    raise
+
+    async def _request(self, path):
+        lines = [f"GET {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        lines += [f"{name}: {value}" for name, value in self.headers.items()]
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await self._writer.drain()
+
+        status_line = await self._reader.readuntil(b"\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b""
+            while True:
+                size = int((await self._reader.readuntil(b"\r\n")).split(b';')[0], 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        else:
+            body = await self._reader.readexactly(int(headers.get('content-length', 0)))
+
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, body
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def summarize(latencies, errors, duration):
+    """Throughput and latency percentiles (ms) for one query shape"""
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / duration, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None
+    }
+
+
+async def _client(client_id, host, port, deadline, warmup_until, seed, latencies, errors):
+    """One simulated client issuing queries back to back until the deadline"""
+    rng = random.Random(seed + client_id)
+    client = HTTPClient(host, port, {'X-API-Key': API_KEYS[client_id % len(API_KEYS)]})
+    shapes = list(QUERY_SHAPES)
+    weights = [QUERY_SHAPES[shape][0] for shape in shapes]
+
+    async def timed_get(shape, params):
+        started = time.perf_counter()
+        try:
+            status, body = await client.get(f"/data?{urlencode(params)}" if params else "/data")
+            ok = status == 200
+        except Exception:
+            ok, body = False, b""
+        finished = time.perf_counter()
+        if started >= warmup_until:
+            if ok:
+                latencies.setdefault(shape, []).append(finished - started)
+            else:
+                errors[shape] = errors.get(shape, 0) + 1
+        return json.loads(body) if ok else None
+
+    try:
+        while time.perf_counter() < deadline:
+            shape = rng.choices(shapes, weights)[0]
+            params = QUERY_SHAPES[shape][1](rng)
+            params['limit'] = rng.choice([10, 50, 100])
+            result = await timed_get(shape, params)
+
+            # Follow next_cursor like a client paging through results
+            if shape == 'cursor_walk':
+                for _ in range(CURSOR_WALK_PAGES - 1):
+                    if not result or not result.get('next_cursor') or time.perf_counter() >= deadline:
+                        break
+                    result = await timed_get(shape, dict(params, cursor=result['next_cursor']))
+    finally:
+        await client.close()
+
+
+async def run_load(url, concurrency=16, duration=30.0, warmup=3.0, seed=0):
+    """Drive ``concurrency`` clients against ``url`` and summarize per shape"""
+    parts = urlsplit(url)
+    started = time.perf_counter()
+    warmup_until = started + warmup
+    deadline = warmup_until + duration
+    latencies = {}
+    errors = {}
+
+    await asyncio.gather(*[
+        _client(client_id, parts.hostname, parts.port or 80, deadline, warmup_until, seed, latencies, errors)
+        for client_id in range(concurrency)
+    ])
+
+    results = {shape: summarize(latencies.get(shape, []), errors.get(shape, 0), duration)
+               for shape in QUERY_SHAPES}
+    results['all'] = summarize([latency for values in latencies.values() for latency in values],
+                               sum(errors.values()), duration)
+    return results
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(target, port, startup_timeout=30, show_logs=False):
+    """Start an API under uvicorn and wait until /health answers"""
+    env = dict(os.environ)
+    # The load comes from a couple of keys, so lift api.py's per-key limit
+    env.setdefault('RATE_LIMIT_PER_MINUTE', '1000000000')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', TARGETS[target], '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', '--no-access-log'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=None if show_logs else subprocess.DEVNULL,
+        stderr=None if show_logs else subprocess.DEVNULL
+    )
+
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{target} exited with code {process.returncode} during startup")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                return process
+        except Exception:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{target} did not become healthy within {startup_timeout}s")
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Regressions of ``results`` against ``baseline`` beyond ``tolerance``
+
+    A shape regresses when its p95 latency grows, or its throughput drops,
+    by more than the tolerance fraction; any new errors also count.
+    """
+    regressions = []
+    for target, shapes in results.items():
+        for shape, current in shapes.items():
+            previous = baseline.get(target, {}).get(shape)
+            if not previous or not previous.get('requests') or not current['requests']:
+                continue
+            if current['p95_ms'] > previous['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{target} {shape}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+            if current['rps'] < previous['rps'] * (1 - tolerance):
+                regressions.append(f"{target} {shape}: rps {previous['rps']} -> {current['rps']}")
+            if current['errors'] > previous['errors']:
+                regressions.append(f"{target} {shape}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def print_report(results):
+    print(f"{'target':<12} {'shape':<12} {'requests':>9} {'errors':>7} {'rps':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for target, shapes in results.items():
+        for shape, stats in shapes.items():
+            print(f"{target:<12} {shape:<12} {stats['requests']:>9} {stats['errors']:>7} {stats['rps']:>9} "
+                  f"{stats['p50_ms'] or '-':>9} {stats['p95_ms'] or '-':>9} {stats['p99_ms'] or '-':>9}")
+
+
+def main():
+    """Parse arguments, run the load test and compare against a baseline"""
+    parser = argparse.ArgumentParser(description='Load test the /data endpoint of the APIs')
+    parser.add_argument('--target', choices=list(TARGETS) + ['both'], default='both',
+                        help='API to test (default: both)')
+    parser.add_argument('--url', help='Test an already running server at this URL instead of starting one')
+    parser.add_argument('--show-server-logs', action='store_true',
+                        help="Pass the started server's log output through")
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('LOADTEST_CONCURRENCY', '16')),
+                        help='Concurrent clients (default: from LOADTEST_CONCURRENCY env var or 16)')
+    parser.add_argument('--duration', type=float, default=float(os.getenv('LOADTEST_DURATION', '30')),
+                        help='Measured seconds per target (default: from LOADTEST_DURATION env var or 30)')
+    parser.add_argument('--warmup', type=float, default=3.0,
+                        help='Unmeasured seconds before measuring (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the query mix (default: 0)')
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against results saved with --save-baseline')
+    parser.add_argument('--save-baseline', help='Save the results as a baseline to this file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed fractional p95/rps change before flagging a regression (default: 0.2)')
+    args = parser.parse_args()
+
+    if args.url:
+        targets = [args.target if args.target != 'both' else 'server']
+    else:
+        targets = list(TARGETS) if args.target == 'both' else [args.target]
+
+    results = {}
+    for target in targets:
+        process = None
+        url = args.url
+        if not url:
+            port = _free_port()
+            process = start_server(target, port, show_logs=args.show_server_logs)
+            url = f"http://127.0.0.1:{port}"
+        try:
+            logging.info(f"Load testing {target} at {url} with {args.concurrency} clients for {args.duration}s")
+            results[target] = asyncio.run(run_load(url, args.concurrency, args.duration, args.warmup, args.seed))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print_report(results)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as output:
+                json.dump(results, output, indent=2)
+            logging.info(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            for regression in regressions:
+                logging.error(f"Regression: {regression}")
+            sys.exit(1)
+        logging.info("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,15 @@ Main entry point for the data pipeline
 import os
 import logging
 import argparse
+from contextlib import nullcontext
 from datetime import datetime
 
 from ingest import ingest_data
-from process import process_files
-from database import initialize_database, store_dataframe
+from process import process_files, source_file_name, rows_per_source_file, ENGINES
+from database import initialize_database, store_dataframe, store_arrow_table, drop_expired_partitions
+from watch import run_watch
+from distributed import TASK_QUEUE_PATH, run_coordinator, run_workers
+from profiling import PROFILE_DIR, StageProfiler
 
 # Configure logging
 logging.basicConfig(
@@ -22,17 +26,29 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-def run_pipeline(sftp_config):
-    """Run the complete data pipeline"""
+def run_pipeline(sftp_config, engine='pandas', retention_months=None, profile_dir=None):
+    """Run the complete data pipeline
+
+    ``engine`` selects the processing path: 'pandas' or 'arrow'. With
+    ``retention_months``, monthly partitions older than that are dropped
+    after a successful load. With ``profile_dir``, each stage is profiled
+    and its reports are written there.
+    """
     logger.info("Starting data pipeline")
+
+    profiler = StageProfiler(profile_dir) if profile_dir else None
+    stage = profiler.stage if profiler else lambda name: nullcontext()
     
     # Step 1: Initialize database
     logger.info("Initializing database")
-    initialize_database()
+    with stage('initialize'):
+        initialize_database()
     
     # Step 2: Ingest data from SFTP
     logger.info("Ingesting data from SFTP")
-    downloaded_files = ingest_data(sftp_config)
+    remote_files = {}
+    with stage('ingest'):
+        downloaded_files = ingest_data(sftp_config, seen=remote_files)
     
     if not downloaded_files:
         logger.warning("No files were downloaded. Pipeline stopped.")
@@ -42,7 +58,8 @@ def run_pipeline(sftp_config):
     
     # Step 3: Process the downloaded files
     logger.info("Processing files")
-    processed_data = process_files(downloaded_files)
+    with stage('process'):
+        processed_data = process_files(downloaded_files, engine)
     
     if processed_data is None:
         logger.error("Failed to process files. Pipeline stopped.")
@@ -50,11 +67,23 @@ def run_pipeline(sftp_config):
     
     logger.info(f"Processed {len(processed_data)} rows of data")
     
+    # Record the files that produced rows, so watch mode does not load them again
+    row_counts = rows_per_source_file(processed_data)
+    files = [{'name': name, 'size': size, 'mtime': mtime, 'row_count': row_counts[source_file_name(name)]}
+             for name, (size, mtime) in remote_files.items() if source_file_name(name) in row_counts]
+
     # Step 4: Store processed data in the database
     logger.info("Storing processed data in the database")
-    success = store_dataframe(processed_data)
+    with stage('store'):
+        if engine == 'arrow':
+            success = store_arrow_table(processed_data, files=files)
+        else:
+            success = store_dataframe(processed_data, files=files)
     
     if success:
+        if retention_months is not None:
+            with stage('retention'):
+                drop_expired_partitions(retention_months)
         logger.info("Pipeline completed successfully")
     else:
         logger.error("Failed to store data in the database")
@@ -76,6 +105,49 @@ def main():
                         help='SFTP remote directory (default: from SFTP_REMOTE_DIR env var or /data)')
     parser.add_argument('--local-dir', default=os.getenv('LOCAL_DIR', './downloaded_data'),
                         help='Local directory for downloaded files (default: from LOCAL_DIR env var or ./downloaded_data)')
+    parser.add_argument('--staging-compression', choices=['gzip', 'bz2', 'zstd'],
+                        default=os.getenv('STAGING_COMPRESSION'),
+                        help='Compress uncompressed downloads in the local directory (default: from STAGING_COMPRESSION env var or off)')
+    parser.add_argument('--engine', choices=ENGINES, default=os.getenv('PIPELINE_ENGINE', 'pandas'),
+                        help='Processing engine (default: from PIPELINE_ENGINE env var or pandas)')
+    parser.add_argument('--retention-months', type=int,
+                        default=int(os.environ['RETENTION_MONTHS']) if os.getenv('RETENTION_MONTHS') else None,
+                        help='Drop monthly partitions older than this many months after each load (default: keep all)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Write a cProfile and tracemalloc report for each pipeline stage (single runs only)')
+    parser.add_argument('--profile-dir', default=PROFILE_DIR,
+                        help='Directory for --profile reports (default: from PROFILE_DIR env var or ./profiles)')
+
+    # Watch mode configuration
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and poll the remote directory for new files')
+    parser.add_argument('--interval', type=float, default=float(os.getenv('WATCH_INTERVAL', '60')),
+                        help='Seconds between polls in watch mode (default: from WATCH_INTERVAL env var or 60)')
+    parser.add_argument('--cron', default=os.getenv('WATCH_CRON'),
+                        help='Cron expression for polls in watch mode, overrides --interval (requires croniter)')
+    parser.add_argument('--jitter', type=float, default=float(os.getenv('WATCH_JITTER', '0.1')),
+                        help='Random delay added to each poll as a fraction of the wait (default: 0.1)')
+    parser.add_argument('--max-workers', type=int, default=int(os.getenv('WATCH_MAX_WORKERS', '2')),
+                        help='Maximum files processed concurrently in watch mode (default: 2)')
+    
+    # Distributed mode configuration
+    parser.add_argument('--enqueue', action='store_true',
+                        help='Download new or grown files and queue them for workers instead of processing them')
+    parser.add_argument('--worker', action='store_true',
+                        help='Process and load queued tasks instead of downloading')
+    parser.add_argument('--queue', default=TASK_QUEUE_PATH,
+                        help='Task queue database shared by coordinator and workers (default: from TASK_QUEUE_PATH env var or ./task_queue.db)')
+    parser.add_argument('--chunk-rows', type=int,
+                        default=int(os.environ['CHUNK_ROWS']) if os.getenv('CHUNK_ROWS') else None,
+                        help='With --enqueue, split uncompressed CSV files into tasks of this many rows (default: from CHUNK_ROWS env var or one task per file)')
+    parser.add_argument('--worker-processes', type=int, default=int(os.getenv('WORKER_PROCESSES', '1')),
+                        help='Worker processes to run on this host (default: from WORKER_PROCESSES env var or 1)')
+    parser.add_argument('--worker-batch', type=int, default=int(os.getenv('WORKER_BATCH', '4')),
+                        help='Tasks a worker leases and loads together (default: from WORKER_BATCH env var or 4)')
+    parser.add_argument('--lease-seconds', type=float, default=float(os.getenv('LEASE_SECONDS', '300')),
+                        help='Seconds before an unrenewed task lease expires and the task is retried (default: from LEASE_SECONDS env var or 300)')
+    parser.add_argument('--exit-when-empty', action='store_true',
+                        help='Stop workers once no tasks are pending or leased')
     
     args = parser.parse_args()
     
@@ -86,11 +158,24 @@ def main():
         'username': args.username,
         'password': args.password,
         'remote_dir': args.remote_dir,
-        'local_dir': args.local_dir
+        'local_dir': args.local_dir,
+        'staging_compression': args.staging_compression
     }
     
     # Run the pipeline
-    run_pipeline(sftp_config)
+    if args.enqueue:
+        run_coordinator(sftp_config, queue_path=args.queue, chunk_rows=args.chunk_rows)
+    elif args.worker:
+        run_workers(queue_path=args.queue, processes=args.worker_processes, engine=args.engine,
+                    batch_size=args.worker_batch, lease_seconds=args.lease_seconds,
+                    exit_when_empty=args.exit_when_empty)
+    elif args.watch:
+        run_watch(sftp_config, interval=args.interval, cron=args.cron,
+                  jitter=args.jitter, max_workers=args.max_workers, engine=args.engine,
+                  retention_months=args.retention_months)
+    else:
+        run_pipeline(sftp_config, engine=args.engine, retention_months=args.retention_months,
+                     profile_dir=args.profile_dir if args.profile else None)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
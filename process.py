@@ -2,51 +2,169 @@
 Data Processing Module
 """
 import pandas as pd
+import io
 import json
 import logging
 import os
 from datetime import datetime
 
+from compression import split_compression, open_compressed
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+
+    # Read empty cells as null, as pandas does, so the missing-value fill applies
+    CSV_CONVERT_OPTIONS = pa_csv.ConvertOptions(strings_can_be_null=True)
+except ImportError:
+    pa = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def process_csv(file_path):
-    """Process a CSV file specifically for TechCorner sales data"""
+ENGINES = ('pandas', 'arrow')
+
+# Specific column renaming for TechCorner data
+TECHCORNER_COLUMN_MAPPING = {
+    'cus_id': 'customer_id',
+    'cus__location': 'customer_location',
+    'does_he_she_come_from_facebook_page': 'from_facebook',
+    'does_he_she_followed_our_page': 'followed_page',
+    'did_he_she_buy_any_mobile_before': 'previous_purchase',
+    'did_he_she_hear_of_our_shop_before': 'heard_of_shop'
+}
+
+NUMERIC_COLUMNS = ['customer_id', 'age', 'sell_price']
+YES_NO_COLUMNS = ['from_facebook', 'followed_page', 'previous_purchase', 'heard_of_shop']
+YES_NO_VALUES = {'yes': 'Yes', 'no': 'No', 'y': 'Yes', 'n': 'No'}
+
+# Low-cardinality string columns kept dictionary-encoded by the Arrow engine
+DICTIONARY_COLUMNS = ['customer_location', 'gender', 'mobile_name', 'source_file'] + YES_NO_COLUMNS
+
+
+def source_file_name(file_path):
+    """Name recorded as source_file, without any compression suffix"""
+    base_name, _ = split_compression(os.path.basename(file_path))
+    return base_name
+
+
+def normalize_column_name(col):
+    """Standardize a CSV header (lowercase, replace spaces and punctuation with underscores)"""
+    return col.lower().replace(' ', '_').replace('.', '_').replace('/', '_').replace('?', '')
+
+
+def _read_record(f):
+    """Read one CSV record from a binary stream; b'' at the end
+
+    A record spans several lines when a quoted field contains newlines.
+    """
+    record = f.readline()
+    while record.count(b'"') % 2:
+        line = f.readline()
+        if not line:
+            break
+        record += line
+    return record
+
+
+def csv_record_ranges(file_path, chunk_rows=None, skip_rows=0):
+    """Byte ranges of the data records in a CSV file, ``chunk_rows`` records each
+
+    Offsets are positions in the decompressed data and fall on record
+    boundaries. Blank lines are not records, as in both CSV readers, and an
+    unterminated quoted record at the end is left out. The first
+    ``skip_rows`` records are skipped. Returns (start, end, rows) tuples.
+    """
+    ranges = []
+    with open_compressed(file_path, 'rb') as f:
+        position = len(_read_record(f))
+        start, rows = position, 0
+        while True:
+            record = _read_record(f)
+            if not record or record.count(b'"') % 2:
+                break
+            position += len(record)
+            if not record.strip():
+                continue
+            if skip_rows:
+                skip_rows -= 1
+                start = position
+                continue
+            rows += 1
+            if rows == chunk_rows:
+                ranges.append((start, position, rows))
+                start, rows = position, 0
+    if rows:
+        ranges.append((start, position, rows))
+    return ranges
+
+
+def _open_csv(file_path, byte_range=None):
+    """Binary stream of a CSV file, or of its header plus a (start, end) byte range of records"""
+    if byte_range is None:
+        return open_compressed(file_path, 'rb')
+    start, end = byte_range
+    with open_compressed(file_path, 'rb') as f:
+        header = _read_record(f)
+        if f.seekable():
+            f.seek(start)
+        else:
+            position = len(header)
+            while position < start:
+                skipped = f.read(min(1024 * 1024, start - position))
+                if not skipped:
+                    break
+                position += len(skipped)
+        return io.BytesIO(header + f.read(end - start))
+
+
+def rows_per_source_file(result):
+    """Number of rows each source file contributed to a DataFrame or Arrow table"""
+    if pa is not None and isinstance(result, pa.Table):
+        return {item['values']: item['counts'] for item in result['source_file'].value_counts().to_pylist()}
+    return result['source_file'].value_counts().to_dict()
+
+
+def process_csv(file_path, byte_range=None):
+    """Process a CSV file specifically for TechCorner sales data
+
+    ``byte_range`` is an optional (start, end) range of records from
+    csv_record_ranges to process instead of the whole file.
+    """
     try:
-        # Read CSV file
-        df = pd.read_csv(file_path)
+        # Read CSV file, decompressing on the fly if needed
+        with _open_csv(file_path, byte_range) as f:
+            df = pd.read_csv(f)
         
         # Basic cleaning operations
         # 1. Standardize column names (lowercase, replace spaces with underscores)
-        df.columns = [col.lower().replace(' ', '_').replace('.', '_').replace('/', '_') for col in df.columns]
+        df.columns = [normalize_column_name(col) for col in df.columns]
         
         # 2. Specific column renaming for TechCorner data
-        column_mapping = {
-            'cus_id': 'customer_id',
-            'cus__location': 'customer_location',
-            'does_he_she_come_from_facebook_page_': 'from_facebook',
-            'does_he_she_followed_our_page_': 'followed_page',
-            'did_he_she_buy_any_mobile_before_': 'previous_purchase',
-            'did_he_she_hear_of_our_shop_before_': 'heard_of_shop'
-        }
-        df.rename(columns=column_mapping, inplace=True)
+        df.rename(columns=TECHCORNER_COLUMN_MAPPING, inplace=True)
         
-        # 3. Convert date to proper datetime format
-        try:
-            df['date'] = pd.to_datetime(df['date'], format='%d-%m-%Y')
-        except:
-            logging.warning(f"Could not convert date column to datetime in file: {file_path}")
+        # 3. Convert date to proper datetime format; unparseable dates become NaT
+        if 'date' in df.columns:
+            dates = pd.to_datetime(df['date'], format='%d-%m-%Y', errors='coerce')
+            invalid = int((dates.isna() & df['date'].notna()).sum())
+            if invalid:
+                logging.warning(f"Could not convert {invalid} dates to datetime in file: {file_path}")
+            df['date'] = dates
         
         # 4. Handle missing values appropriately
         for column in df.columns:
-            if column in ['customer_id', 'age', 'sell_price']:
+            if column in NUMERIC_COLUMNS:
                 # For numeric columns
                 df[column] = df[column].fillna(0)
-            elif column in ['from_facebook', 'followed_page', 'previous_purchase', 'heard_of_shop']:
+            elif column in YES_NO_COLUMNS:
                 # For yes/no columns
                 df[column] = df[column].fillna('Unknown')
                 # Standardize yes/no values
-                df[column] = df[column].str.lower().replace({'yes': 'Yes', 'no': 'No', 'y': 'Yes', 'n': 'No'})
+                df[column] = df[column].str.lower().replace(YES_NO_VALUES)
+            elif column == 'date':
+                # Missing and unparseable dates stay NaT
+                continue
             else:
                 # For other string columns
                 df[column] = df[column].fillna('Unknown')
@@ -56,7 +174,7 @@ def process_csv(file_path):
             df['gender'] = df['gender'].str.strip().str.capitalize()
         
         # 6. Add processing metadata
-        df['source_file'] = os.path.basename(file_path)
+        df['source_file'] = source_file_name(file_path)
         df['processed_at'] = datetime.now()
         
         logging.info(f"Successfully processed CSV file: {file_path}")
@@ -69,8 +187,8 @@ def process_csv(file_path):
 def process_json(file_path):
     """Process a JSON file"""
     try:
-        # Read JSON file
-        with open(file_path, 'r') as f:
+        # Read JSON file, decompressing on the fly if needed
+        with open_compressed(file_path, 'rt') as f:
             data = json.load(f)
         
         # Handle different JSON structures
@@ -95,7 +213,7 @@ def process_json(file_path):
                 df[column] = df[column].fillna('Unknown')
         
         # Add processing metadata
-        df['source_file'] = os.path.basename(file_path)
+        df['source_file'] = source_file_name(file_path)
         df['processed_at'] = datetime.now()
         
         logging.info(f"Successfully processed JSON file: {file_path}")
@@ -105,30 +223,183 @@ def process_json(file_path):
         return None
 
 
-def process_file(file_path):
-    """Process a file based on its extension"""
-    if file_path.endswith('.csv'):
-        return process_csv(file_path)
-    elif file_path.endswith('.json'):
-        return process_json(file_path)
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The arrow engine requires the 'pyarrow' package (pip install pyarrow)")
+
+
+def _add_metadata_arrow(table, file_path):
+    """Append the source_file and processed_at columns to an Arrow table"""
+    num_rows = table.num_rows
+    source_file = pa.DictionaryArray.from_arrays(
+        pa.array([0] * num_rows, type=pa.int32()),
+        pa.array([source_file_name(file_path)])
+    )
+    processed_at = pa.repeat(pa.scalar(datetime.now(), type=pa.timestamp('us')), num_rows)
+    table = table.append_column('source_file', source_file)
+    return table.append_column('processed_at', processed_at)
+
+
+def process_csv_arrow(file_path, byte_range=None):
+    """Process a TechCorner CSV file into an Arrow table
+
+    Applies the same cleaning as process_csv using Arrow compute kernels, and
+    keeps low-cardinality string columns dictionary-encoded. ``byte_range``
+    is as in process_csv.
+    """
+    try:
+        _require_pyarrow()
+
+        # Read CSV file, decompressing on the fly if needed
+        with _open_csv(file_path, byte_range) as f:
+            table = pa_csv.read_csv(f, convert_options=CSV_CONVERT_OPTIONS)
+
+        # 1-2. Standardize and rename columns
+        names = [normalize_column_name(col) for col in table.column_names]
+        table = table.rename_columns([TECHCORNER_COLUMN_MAPPING.get(name, name) for name in names])
+
+        columns = {}
+        for name in table.column_names:
+            column = table[name]
+
+            if name == 'date' and (pa.types.is_string(column.type) or pa.types.is_null(column.type)):
+                # 3. Convert date to proper datetime format; unparseable dates become null
+                dates = pc.strptime(column.cast(pa.string()), format='%d-%m-%Y', unit='ns', error_is_null=True)
+                invalid = dates.null_count - column.null_count
+                if invalid:
+                    logging.warning(f"Could not convert {invalid} dates to datetime in file: {file_path}")
+                column = dates
+            elif name in NUMERIC_COLUMNS:
+                # 4. Handle missing values appropriately
+                column = pc.fill_null(column, 0)
+            elif name in YES_NO_COLUMNS:
+                column = pc.utf8_lower(pc.fill_null(column.cast(pa.string()), 'Unknown'))
+                standardized = column
+                for raw, value in YES_NO_VALUES.items():
+                    standardized = pc.if_else(pc.equal(column, raw), value, standardized)
+                column = standardized
+            elif pa.types.is_string(column.type) or pa.types.is_null(column.type):
+                column = pc.fill_null(column.cast(pa.string()), 'Unknown')
+
+            # 5. Clean gender column
+            if name == 'gender':
+                column = pc.utf8_capitalize(pc.utf8_trim_whitespace(column))
+
+            if name in DICTIONARY_COLUMNS:
+                column = column.dictionary_encode()
+            columns[name] = column
+
+        table = pa.table(columns)
+
+        # 6. Add processing metadata
+        table = _add_metadata_arrow(table, file_path)
+
+        logging.info(f"Successfully processed CSV file: {file_path}")
+        return table
+    except Exception as e:
+        logging.error(f"Error processing CSV file {file_path}: {str(e)}")
+        return None
+
+
+def _flattened_keys(records, prefix=''):
+    """Dotted keys of a list of JSON objects, in the order they first appear"""
+    keys = {}
+    for record in records:
+        # Like json_normalize, each record's nested keys follow its plain ones
+        nested = []
+        for key, value in record.items():
+            if isinstance(value, dict):
+                nested.extend(_flattened_keys([value], f"{prefix}{key}."))
+            else:
+                keys[f"{prefix}{key}"] = None
+        keys.update(dict.fromkeys(nested))
+    return list(keys)
+
+
+def process_json_arrow(file_path):
+    """Process a JSON file into an Arrow table"""
+    try:
+        _require_pyarrow()
+
+        # Read JSON file, decompressing on the fly if needed
+        with open_compressed(file_path, 'rt') as f:
+            data = json.load(f)
+
+        if isinstance(data, dict):
+            data = [data]
+        elif not isinstance(data, list):
+            logging.error(f"Unsupported JSON structure in {file_path}")
+            return None
+
+        # Infer the columns from every object, not just the first, and flatten
+        # nested objects the same way json_normalize does
+        table = pa.Table.from_struct_array(pa.array(data)) if data else pa.table({})
+        while any(pa.types.is_struct(field.type) for field in table.schema):
+            table = table.flatten()
+        # Inferred struct fields come out sorted; keep json_normalize's first-seen order
+        table = table.select([name for name in _flattened_keys(data) if name in table.column_names])
+        table = table.rename_columns([col.lower().replace('.', '_').replace(' ', '_') for col in table.column_names])
+
+        # Handle missing values
+        columns = {}
+        for name in table.column_names:
+            column = table[name]
+            if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+                column = pc.fill_null(column, 0)
+            elif pa.types.is_string(column.type) or pa.types.is_null(column.type):
+                column = pc.fill_null(column.cast(pa.string()), 'Unknown')
+            columns[name] = column
+        table = pa.table(columns)
+
+        # Add processing metadata
+        table = _add_metadata_arrow(table, file_path)
+
+        logging.info(f"Successfully processed JSON file: {file_path}")
+        return table
+    except Exception as e:
+        logging.error(f"Error processing JSON file {file_path}: {str(e)}")
+        return None
+
+
+def process_file(file_path, engine='pandas', byte_range=None):
+    """Process a file based on its extension, ignoring any compression suffix
+
+    ``engine='arrow'`` returns a pyarrow Table instead of a pandas DataFrame.
+    ``byte_range`` limits a CSV file to a (start, end) range of bytes from
+    csv_record_ranges.
+    """
+    base_name, _ = split_compression(file_path)
+    if base_name.endswith('.csv'):
+        if engine == 'arrow':
+            return process_csv_arrow(file_path, byte_range)
+        return process_csv(file_path, byte_range)
+    elif base_name.endswith('.json'):
+        return process_json_arrow(file_path) if engine == 'arrow' else process_json(file_path)
     else:
         logging.warning(f"Unsupported file format: {file_path}")
         return None
 
 
-def process_files(file_paths):
+def combine_results(results, engine='pandas'):
+    """Combine processed DataFrames or Arrow tables into one"""
+    if engine == 'arrow':
+        return pa.concat_tables(results, promote_options='default')
+    return pd.concat(results, ignore_index=True)
+
+
+def process_files(file_paths, engine='pandas'):
     """Process multiple files"""
     dataframes = []
 
     for file_path in file_paths:
-        df = process_file(file_path)
+        df = process_file(file_path, engine)
         if df is not None:
             dataframes.append(df)
 
     if dataframes:
         # Combine all dataframes
         try:
-            combined_df = pd.concat(dataframes, ignore_index=True)
+            combined_df = combine_results(dataframes, engine)
             return combined_df
         except Exception as e:
             logging.error(f"Error combining dataframes: {str(e)}")
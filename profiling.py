@@ -0,0 +1,150 @@
+"""
+Profiling Module
+
+Opt-in profiling hooks. StageProfiler records a cProfile and the tracemalloc
+peak for each stage of a pipeline run; StackSampler samples the call stacks
+of the process's threads into the collapsed format read by flamegraph.pl and
+speedscope, for profiling individual API requests. Nothing here runs unless enabled.
+"""
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', './profiles')
+
+# Request profiles kept in PROFILE_DIR; older ones are deleted as new ones are saved
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '100'))
+
+# Functions listed in each stage's text report
+REPORT_FUNCTIONS = 30
+
+# Allocation sites listed per stage (still allocated when the stage ends)
+REPORT_ALLOCATIONS = 10
+
+
+class StageProfiler:
+    """Profile the stages of one pipeline run
+
+    Each stage writes <run>_<stage>.prof (pstats format, e.g. for snakeviz
+    or flameprof) and a text report of the slowest functions and largest
+    allocation sites. summary.json holds wall time and peak memory per stage.
+    """
+
+    def __init__(self, output_dir=PROFILE_DIR):
+        self.run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.output_dir = output_dir
+        self.stages = {}
+        os.makedirs(output_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name):
+        """Profile the enclosed block as stage ``name``"""
+        tracemalloc.start()
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self._write_stage(name, profile, snapshot, elapsed, peak)
+
+    def _write_stage(self, name, profile, snapshot, elapsed, peak):
+        prefix = os.path.join(self.output_dir, f"{self.run_id}_{name}")
+        profile.dump_stats(f"{prefix}.prof")
+
+        allocations = snapshot.statistics('lineno')[:REPORT_ALLOCATIONS]
+        with open(f"{prefix}.txt", 'w') as report:
+            report.write(f"Stage {name}: {elapsed:.3f}s wall, {peak / 2**20:.1f} MiB peak traced memory\n\n")
+            report.write("Largest allocation sites still held at the end of the stage:\n")
+            for statistic in allocations:
+                report.write(f"  {statistic}\n")
+            report.write("\n")
+            pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(REPORT_FUNCTIONS)
+
+        self.stages[name] = {
+            'seconds': round(elapsed, 3),
+            'peak_memory_mib': round(peak / 2**20, 1),
+            'profile': f"{prefix}.prof",
+            'report': f"{prefix}.txt"
+        }
+        with open(os.path.join(self.output_dir, f"{self.run_id}_summary.json"), 'w') as summary:
+            json.dump(self.stages, summary, indent=2)
+        logging.info(f"Profiled stage {name}: {elapsed:.3f}s, peak {peak / 2**20:.1f} MiB ({prefix}.txt)")
+
+
+class StackSampler:
+    """Sample the call stacks of the running threads at a fixed interval
+
+    Use as a context manager around the code to profile; collapsed() then
+    returns "thread;frame;frame count" lines for flamegraph tools. Every
+    thread is sampled unless ``thread_id`` picks one, since the profiled work
+    may run on threadpool workers rather than the thread that started the
+    sampler. Sampling runs in a daemon thread, so the profiled code is not
+    instrumented.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        sampler_id = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id or (self.thread_id is not None and thread_id != self.thread_id):
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                # Root each stack at its thread so flame graphs keep threads apart
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._stop_event.set()
+        self._thread.join()
+
+    def collapsed(self):
+        """Samples in collapsed-stack format, one stack per line"""
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+
+def prune_profiles(directory=PROFILE_DIR, keep=PROFILE_KEEP, suffix='.folded'):
+    """Delete all but the ``keep`` newest profiles ending in ``suffix``
+
+    Profile names start with their timestamp, so name order is age order.
+    """
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(suffix))
+        for name in names[:max(len(names) - keep, 0)]:
+            os.remove(os.path.join(directory, name))
+    except OSError as e:
+        logging.warning(f"Could not prune profiles in {directory}: {str(e)}")
@@ -0,0 +1,608 @@
+"""
+Query Module
+
+Read-only access to the sales data for the APIs: filtering, pagination,
+counts and batches. It depends only on SQLAlchemy and the schema module, not
+on pandas, paramiko or the ingestion code, so API workers start quickly.
+"""
+import logging
+import weakref
+from datetime import datetime
+from sqlalchemy import text, select, func, or_, literal, literal_column, union_all, bindparam, Integer
+
+from schema import (
+    engine, Session, Load, FactPartition, ZoneMap, CustomerSummary, Answer, UNDATED_PARTITION,
+    DIMENSION_COLUMNS, ENGAGEMENT_COLUMNS, OUTPUT_COLUMNS, MIN_SEARCH_LENGTH,
+    list_partitions, partition_table, search_table, schema_is_current, _as_datetime
+)
+from sqlalchemy.orm import Session as OrmSession, aliased
+from zonemap import BloomFilter, zone_may_match
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Beyond this many surviving id ranges, the OR of BETWEENs costs more than it saves
+MAX_ZONE_RANGES = 200
+
+# Dimensions with so few values that each matches a large share of the rows;
+# reading their index and then every matching row is slower than a scan
+SCAN_KEY_COLUMNS = {'gender'}
+
+# Connection info key for the read cache of a SQLite connection, see _read_cache
+READ_CACHE = 'read_cache'
+
+# Page, row and count statements kept for reuse, see _cached_statement
+MAX_CACHED_STATEMENTS = 256
+_statements = {}
+
+# The processed_data row shape per partition table, see _processed_data_select
+_dimension_aliases = {column: aliased(model, name=f"{column}_dim") for column, model in DIMENSION_COLUMNS.items()}
+_processed_data_selects = {}
+
+
+def _read_cache(conn):
+    """Zone maps and search index flags cached on a SQLite connection, or None
+
+    The cache holds for as long as the data the connection reads is
+    unchanged: PRAGMA data_version moves when another connection commits a
+    load and total_changes when this one writes. A read transaction sees one
+    snapshot, so this is checked once per transaction, not once per lookup.
+    """
+    if isinstance(conn, OrmSession):
+        conn = conn.connection()
+    if conn.dialect.name != 'sqlite':
+        return None
+
+    transaction = conn.get_transaction()
+    cache = conn.info.get(READ_CACHE)
+    if cache is None or transaction is None or cache['transaction']() is not transaction:
+        version = (conn.exec_driver_sql("PRAGMA data_version").scalar(),
+                   conn.connection.dbapi_connection.total_changes)
+        if cache is None or cache['version'] != version:
+            cache = conn.info[READ_CACHE] = {'version': version, 'zone_maps': {}, 'search_index': {}}
+        # The PRAGMA began a transaction if none was open
+        cache['transaction'] = weakref.ref(conn.get_transaction())
+    return cache
+
+
+def _cached_statement(key, build):
+    """The statement built by ``build`` for ``key``, built once and then reused
+
+    Statements take dates, ages and id ranges as bound parameters, so a
+    repeated query shape skips building the per-partition arms, and SQLAlchemy reuses
+    the cache key memoized on the statement instead of walking every arm.
+    """
+    statement = _statements.get(key)
+    if statement is None:
+        if len(_statements) >= MAX_CACHED_STATEMENTS:
+            _statements.clear()
+        statement = _statements[key] = build()
+    return statement
+
+
+def _zone_maps(conn, partition_name):
+    """Zone map rows of a partition, with their bloom filters deserialized"""
+    if isinstance(conn, OrmSession):
+        conn = conn.connection()
+
+    cache = _read_cache(conn)
+    if cache is not None and partition_name in cache['zone_maps']:
+        return cache['zone_maps'][partition_name]
+
+    zone_maps = [
+        dict(zone_map,
+             mobile_name_bloom=BloomFilter.from_bytes(zone_map['mobile_name_bloom']),
+             customer_location_bloom=BloomFilter.from_bytes(zone_map['customer_location_bloom']))
+        for zone_map in conn.execute(
+            select(ZoneMap.__table__).where(ZoneMap.partition == partition_name)
+        ).mappings()
+    ]
+    if cache is not None:
+        cache['zone_maps'][partition_name] = zone_maps
+    return zone_maps
+
+
+def candidate_id_ranges(conn, partition, start_date=None, end_date=None, min_age=None, max_age=None, keys=None):
+    """Id ranges of a partition that may hold rows matching the filters
+
+    Returns None when the partition has no complete zone maps (nothing can be
+    skipped), an empty list when the whole partition can be skipped, or a
+    list of merged (min_id, max_id) ranges. Files are checked first so their
+    chunks are only read when the file as a whole may match.
+    """
+    start_date = _as_datetime(start_date) if start_date else None
+    end_date = _as_datetime(end_date) if end_date else None
+
+    zone_maps = _zone_maps(conn, partition.name)
+    if sum(zone_map['row_count'] for zone_map in zone_maps if zone_map['chunk'] is None) != partition.row_count:
+        return None
+
+    matching_loads = {zone_map['load_id'] for zone_map in zone_maps
+                      if zone_map['chunk'] is None
+                      and zone_may_match(zone_map, start_date, end_date, min_age, max_age, keys)}
+    ranges = sorted((zone_map['min_id'], zone_map['max_id']) for zone_map in zone_maps
+                    if zone_map['chunk'] is not None and zone_map['load_id'] in matching_loads
+                    and zone_may_match(zone_map, start_date, end_date, min_age, max_age, keys))
+
+    merged = []
+    for low, high in ranges:
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def _processed_data_select(fact):
+    """Typed SQLAlchemy equivalent of the processed_data view over one partition
+
+    Built once per partition table and reused, so executing it hits
+    SQLAlchemy's compiled statement cache instead of rebuilding the joins.
+    """
+    if fact.name not in _processed_data_selects:
+        columns = []
+        joins = []
+        for column in OUTPUT_COLUMNS:
+            if column in DIMENSION_COLUMNS:
+                dimension = _dimension_aliases[column]
+                columns.append(dimension.value.label(column))
+                joins.append((dimension, dimension.id == fact.c[f"{column}_id"]))
+            elif column in ('source_file', 'processed_at'):
+                columns.append(getattr(Load, column).label(column))
+            else:
+                columns.append(fact.c[column].label(column))
+
+        query = select(*columns).select_from(fact).join(Load, Load.id == fact.c.load_id)
+        for dimension, condition in joins:
+            query = query.outerjoin(dimension, condition)
+        _processed_data_selects[fact.name] = query
+    return _processed_data_selects[fact.name]
+
+
+def _item_dict(row, columns=OUTPUT_COLUMNS):
+    item_dict = {}
+    for column in columns:
+        value = row[column]
+        # Convert datetime objects to ISO format strings
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        item_dict[column] = value
+    return item_dict
+
+
+def _has_search_index(session, column):
+    if engine.dialect.name != 'sqlite':
+        return False
+    cache = _read_cache(session)
+    if column not in cache['search_index']:
+        cache['search_index'][column] = session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": search_table(column)}
+        ).first() is not None
+    return cache['search_index'][column]
+
+
+def _matching_keys(session, column, term):
+    """Dimension keys whose value contains ``term`` (case-insensitive)
+
+    Routed through the FTS5 trigram index when it exists and the term is long
+    enough; otherwise an ILIKE over the (small) dimension table.
+    """
+    model = DIMENSION_COLUMNS[column]
+    if len(term) >= MIN_SEARCH_LENGTH and _has_search_index(session, column):
+        phrase = '"' + term.replace('"', '""') + '"'
+        rows = session.execute(
+            text(f"SELECT rowid FROM {search_table(column)} WHERE {search_table(column)} MATCH :phrase"),
+            {"phrase": phrase}
+        )
+    else:
+        rows = session.execute(select(model.id).where(model.value.ilike(f"%{term}%")))
+    return [row[0] for row in rows]
+
+
+def _exact_keys(session, column, value):
+    model = DIMENSION_COLUMNS[column]
+    return [row[0] for row in session.execute(select(model.id).where(model.value == value))]
+
+
+def _resolve_filters(session, location, gender, mobile_name):
+    """Resolve the string filters against the dimensions into lists of keys"""
+    keys = {}
+    if location:
+        keys['customer_location'] = _matching_keys(session, 'customer_location', location)
+    if gender:
+        keys['gender'] = _exact_keys(session, 'gender', gender)
+    if mobile_name:
+        keys['mobile_name'] = _matching_keys(session, 'mobile_name', mobile_name)
+    return keys
+
+
+def _filter_params(start_date, end_date, min_age, max_age):
+    """Bound parameter values of a query's date and age filters"""
+    params = {}
+    if start_date:
+        params['start_date'] = start_date
+    if end_date:
+        params['end_date'] = end_date
+    if min_age is not None:
+        params['min_age'] = min_age
+    if max_age is not None:
+        params['max_age'] = max_age
+    return params
+
+
+def _filter_shape(params, keys):
+    """The filters of a query as the hashable key of its cached statements
+
+    Dates bind with the type a literal comparison would pick, so a ``date``
+    is compared as a date and a ``datetime`` as a timestamp. Dimension keys
+    are few and written into the statement: bound lists would make
+    SQLAlchemy rewrite the SQL of every partition arm at each execution.
+    """
+    date_type = partition_table(UNDATED_PARTITION).c.date.type
+    shape = [(name, type(date_type.coerce_compared_value(None, value)) if name in ('start_date', 'end_date') else None)
+             for name, value in params.items()]
+    shape += [(f"{column}_keys", tuple(column_keys)) for column, column_keys in keys.items()]
+    return tuple(shape)
+
+
+def _build_filters(fact, filters, range_count=None):
+    """Conditions on one fact partition for a _filter_shape
+
+    ``range_count`` restricts the partition to that many zone map id ranges,
+    bound as {partition}_low_{i} and {partition}_high_{i}.
+    """
+    filters = dict(filters)
+    conditions = []
+
+    # Apply date filters
+    if 'start_date' in filters:
+        conditions.append(fact.c.date >= bindparam('start_date', type_=filters['start_date']()))
+    if 'end_date' in filters:
+        conditions.append(fact.c.date <= bindparam('end_date', type_=filters['end_date']()))
+
+    # Apply customer demographic and product filters as integer key lookups
+    for column in DIMENSION_COLUMNS:
+        if f"{column}_keys" in filters:
+            key_column = fact.c[f"{column}_id"]
+            if column in SCAN_KEY_COLUMNS:
+                # An expression, so SQLite scans instead of using the column's index
+                key_column = key_column + 0
+            conditions.append(key_column.in_([literal_column(str(int(key))) for key in filters[f"{column}_keys"]]))
+    if 'min_age' in filters:
+        conditions.append(fact.c.age >= bindparam('min_age'))
+    if 'max_age' in filters:
+        conditions.append(fact.c.age <= bindparam('max_age'))
+
+    if range_count:
+        conditions.append(or_(*[
+            fact.c.id.between(bindparam(f"{fact.name}_low_{i}"), bindparam(f"{fact.name}_high_{i}"))
+            for i in range(range_count)
+        ]))
+    return conditions
+
+
+def _covers_partition(partition, start_date, end_date):
+    """Whether every row of a partition falls inside the date range"""
+    if start_date is None and end_date is None:
+        return True
+    if partition.period_start is None:
+        return False
+    if start_date and partition.period_start < _as_datetime(start_date):
+        return False
+    if end_date and partition.period_end > _as_datetime(end_date):
+        return False
+    return True
+
+
+def _plan_query(session, start_date, end_date, location, gender, min_age, max_age, mobile_name):
+    """Partitions to read for one set of filters, and the parameters to bind
+
+    ``range_counts`` maps each partition to the number of zone map id ranges
+    it is restricted to, or None to read it whole.
+    """
+    partitions = list_partitions(session, start_date, end_date)
+    keys = _resolve_filters(session, location, gender, mobile_name)
+    params = _filter_params(start_date, end_date, min_age, max_age)
+    filters = _filter_shape(params, keys)
+    if any(not column_keys for column_keys in keys.values()):
+        # A filter value that is in no dimension matches nothing
+        partitions = []
+
+    # Use the zone maps to skip partitions, files and chunks that
+    # cannot match, and restrict the rest to the surviving id ranges. Only
+    # the bloom filtered columns and age can rule out rows of a partition
+    # the date range covers, so without them such partitions are read whole
+    bloom_keys = {column: keys[column] for column in ('mobile_name', 'customer_location') if column in keys}
+    zone_filters = bool(bloom_keys) or min_age is not None or max_age is not None
+    range_counts = {}
+    for partition in partitions:
+        if partition.row_count == 0:
+            continue
+        ranges = None
+        if zone_filters or not _covers_partition(partition, start_date, end_date):
+            ranges = candidate_id_ranges(session, partition, start_date, end_date, min_age, max_age, bloom_keys)
+        if ranges == []:
+            continue
+        # A single range over the whole partition restricts nothing
+        if ranges is not None and len(ranges) == 1 and ranges[0] == (partition.min_id, partition.max_id):
+            ranges = None
+        if ranges is not None and len(ranges) <= MAX_ZONE_RANGES:
+            for i, (low, high) in enumerate(ranges):
+                params[f"{partition.name}_low_{i}"] = low
+                params[f"{partition.name}_high_{i}"] = high
+            range_counts[partition.name] = len(ranges)
+        else:
+            range_counts[partition.name] = None
+
+    return {
+        "partitions": [partition for partition in partitions if partition.name in range_counts],
+        "filters": filters,
+        "range_counts": range_counts,
+        "params": params,
+        "only_date_filters": not keys and min_age is None and max_age is None
+    }
+
+
+def _page_statement(filters, arms, after_cursor):
+    """Matching (id, partition) pairs of the given partition arms, merged in id order"""
+    selects = []
+    for name, range_count in arms:
+        fact = partition_table(name)
+        arm = select(fact.c.id.label('id'), literal(name).label('partition')).where(
+            *_build_filters(fact, filters, range_count)
+        )
+
+        # Apply cursor-based pagination
+        if after_cursor:
+            arm = arm.where(fact.c.id > bindparam('cursor'))
+        selects.append(arm)
+
+    page_query = union_all(*selects)
+    return page_query.order_by(page_query.selected_columns.id).limit(bindparam('limit', type_=Integer))
+
+
+def _rows_statement(names):
+    """processed_data rows of the ids bound as {partition}_ids, per partition"""
+    return union_all(*[
+        _processed_data_select(partition_table(name)).where(
+            partition_table(name).c.id.in_(bindparam(f"{name}_ids", expanding=True))
+        )
+        for name in names
+    ])
+
+
+def _count_statement(filters, arms):
+    """One count per partition arm"""
+    return union_all(*[
+        select(func.count()).select_from(partition_table(name)).where(
+            *_build_filters(partition_table(name), filters, range_count)
+        )
+        for name, range_count in arms
+    ])
+
+
+def _fetch_page(session, plan, cursor, limit):
+    """One page of rows for a query plan, plus the cursor for the next page
+
+    Matching ids from every partition are merged by a single UNION ALL
+    ordered by id; SQLite runs it as a merge of per-partition id scans that
+    stops as soon as the page is full.
+    """
+    # Page through matching fact ids with integer comparisons only
+    arms = tuple(
+        (partition.name, plan["range_counts"][partition.name]) for partition in plan["partitions"]
+        if not (cursor and partition.max_id is not None and partition.max_id <= int(cursor))
+    )
+
+    page = []
+    if arms:
+        page_query = _cached_statement(('page', plan["filters"], arms, bool(cursor)),
+                                       lambda: _page_statement(plan["filters"], arms, bool(cursor)))
+        # +1 to check if there are more results
+        params = dict(plan["params"], limit=limit + 1)
+        if cursor:
+            params['cursor'] = int(cursor)
+        page = [(row.id, row.partition) for row in session.execute(page_query, params)]
+
+    # Check if there are more results
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    # Generate next cursor
+    next_cursor = str(page[-1][0]) if has_more and page else None
+
+    # Resolve the page's dimension keys back into values in one query
+    rows_by_id = {}
+    names = tuple(sorted({name for _, name in page}))
+    if names:
+        rows_query = _cached_statement(('rows', names), lambda: _rows_statement(names))
+        params = {f"{name}_ids": [fact_id for fact_id, partition in page if partition == name] for name in names}
+        for row in session.execute(rows_query, params).mappings():
+            rows_by_id[row['id']] = row
+
+    data_dicts = [_item_dict(rows_by_id[fact_id]) for fact_id, _ in page]
+
+    return data_dicts, next_cursor
+
+
+def _count_matches(session, plan, start_date, end_date):
+    """Total matching records
+
+    Partitions that lie entirely inside the date range of a date-only query
+    are counted from the catalog; the rest are counted by one UNION ALL.
+    """
+    total_count = 0
+    arms = []
+    for partition in plan["partitions"]:
+        if plan["only_date_filters"] and _covers_partition(partition, start_date, end_date):
+            total_count += partition.row_count
+        else:
+            arms.append((partition.name, plan["range_counts"][partition.name]))
+    if arms:
+        arms = tuple(arms)
+        count_query = _cached_statement(('count', plan["filters"], arms),
+                                        lambda: _count_statement(plan["filters"], arms))
+        total_count += sum(row[0] for row in session.execute(count_query, plan["params"]))
+    return total_count
+
+
+def get_data(start_date=None, end_date=None, location=None, gender=None,
+           min_age=None, max_age=None, mobile_name=None, cursor=None, limit=50):
+    """Retrieve TechCorner sales data with optional filtering and pagination
+
+    Only the monthly partitions overlapping the date range are queried.
+    """
+    try:
+        logging.info(f"get_data called with params: start_date={start_date}, end_date={end_date}, "
+                    f"location={location}, gender={gender}, min_age={min_age}, max_age={max_age}, "
+                    f"mobile_name={mobile_name}, cursor={cursor}, limit={limit}")
+
+        session = Session()
+
+        try:
+            plan = _plan_query(session, start_date, end_date, location, gender, min_age, max_age, mobile_name)
+            items, next_cursor = _fetch_page(session, plan, cursor, limit)
+            return {
+                "items": items,
+                "next_cursor": next_cursor,
+                "total_count": _count_matches(session, plan, start_date, end_date)
+            }
+        except Exception as e:
+            logging.error(f"Error in query execution: {str(e)}")
+            return None
+        finally:
+            session.close()
+    except Exception as e:
+        logging.error(f"Error retrieving data from database: {str(e)}")
+        return None
+
+
+# Filter arguments of get_data, in order; a batch query may also set cursor and limit
+QUERY_FILTERS = ['start_date', 'end_date', 'location', 'gender', 'min_age', 'max_age', 'mobile_name']
+
+
+def get_data_batch(queries):
+    """Run several get_data queries in one session and read transaction
+
+    ``queries`` is a list of dicts of get_data keyword arguments. All results
+    come from the same snapshot. Identical queries run once, and queries that
+    differ only in cursor or limit share their filter resolution and total
+    count. Returns the results in order, with None for any query that failed.
+    """
+    logging.info(f"get_data_batch called with {len(queries)} queries")
+    session = Session()
+
+    plans = {}
+    counts = {}
+    pages = {}
+    results = []
+    try:
+        for query in queries:
+            filters = tuple(query.get(name) for name in QUERY_FILTERS)
+            page_key = filters + (query.get('cursor'), query.get('limit', 50))
+            if page_key not in pages:
+                try:
+                    if filters not in plans:
+                        plans[filters] = _plan_query(session, *filters)
+                        counts[filters] = _count_matches(session, plans[filters], filters[0], filters[1])
+                    items, next_cursor = _fetch_page(session, plans[filters], page_key[-2], page_key[-1])
+                    pages[page_key] = {
+                        "items": items,
+                        "next_cursor": next_cursor,
+                        "total_count": counts[filters]
+                    }
+                except Exception as e:
+                    logging.error(f"Error in batch query {query}: {str(e)}")
+                    pages[page_key] = None
+            results.append(pages[page_key])
+
+        logging.info(f"Ran {len(pages)} distinct queries for a batch of {len(queries)}")
+        return results
+    finally:
+        session.close()
+
+
+# customer_summary columns returned as stored; the engagement answers follow them
+CUSTOMER_COLUMNS = ['customer_id', 'first_purchase', 'last_purchase', 'purchase_count', 'total_spend']
+
+
+def get_customer(customer_id, limit=100):
+    """A customer's purchase summary and latest purchases, or None if there are none
+
+    The summary is a primary key lookup in customer_summary. Purchases are
+    read newest first from the (customer_id, date) index of only the
+    partitions between the customer's first and last purchase.
+    """
+    logging.info(f"get_customer called with customer_id={customer_id}, limit={limit}")
+    session = Session()
+    try:
+        answers = [aliased(Answer, name=f"{column}_dim") for column in ENGAGEMENT_COLUMNS]
+        summary_query = select(
+            *[getattr(CustomerSummary, column) for column in CUSTOMER_COLUMNS],
+            *[answer.value.label(column) for answer, column in zip(answers, ENGAGEMENT_COLUMNS)]
+        ).where(CustomerSummary.customer_id == customer_id)
+        for answer, column in zip(answers, ENGAGEMENT_COLUMNS):
+            summary_query = summary_query.outerjoin(answer, answer.id == getattr(CustomerSummary, f"{column}_id"))
+        summary = session.execute(summary_query).mappings().first()
+        if summary is None:
+            return None
+
+        partitions = []
+        if summary['first_purchase'] is not None:
+            partitions = list_partitions(session, summary['first_purchase'], summary['last_purchase'])[::-1]
+        # Undated purchases sort last
+        partitions += [partition for partition in list_partitions(session) if partition.name == UNDATED_PARTITION]
+
+        purchases = []
+        for partition in partitions:
+            if len(purchases) >= limit:
+                break
+            fact = partition_table(partition.name)
+            rows = session.execute(
+                _processed_data_select(fact).where(fact.c.customer_id == customer_id)
+                .order_by(fact.c.date.desc(), fact.c.id.desc()).limit(limit - len(purchases))
+            ).mappings()
+            purchases.extend(_item_dict(row) for row in rows)
+
+        return dict(_item_dict(summary, CUSTOMER_COLUMNS + ENGAGEMENT_COLUMNS), purchases=purchases)
+    finally:
+        session.close()
+
+
+def count_records():
+    """Total number of stored sales rows, read from the partition catalog"""
+    with engine.connect() as conn:
+        return conn.execute(select(func.coalesce(func.sum(FactPartition.row_count), 0))).scalar()
+
+
+def ensure_database():
+    """Make sure the database exists and is up to date
+
+    Only reads when the schema is current; the write path (and with it
+    pandas) is imported only when tables must be created or migrated.
+    """
+    with engine.connect() as conn:
+        if schema_is_current(conn):
+            return
+    from database import initialize_database
+    initialize_database()
+
+
+def warm_up():
+    """Prime the read path before serving, e.g. in a pre-fork master
+
+    Runs representative queries so SQLAlchemy compiles and caches their
+    statements and the partition tables are built, then closes the pooled
+    connections so forked workers open their own.
+    """
+    try:
+        ensure_database()
+        get_data(limit=1)
+        get_data(start_date=datetime(1970, 1, 1), location='warm', gender='warm', min_age=0, max_age=0,
+                 mobile_name='warm', cursor='0', limit=1)
+        logging.info("Query path warmed up")
+    except Exception as e:
+        logging.warning(f"Warm-up failed: {str(e)}")
+    finally:
+        engine.dispose()
@@ -0,0 +1,359 @@
+"""
+Database Schema Module
+
+Engine, table models and partition catalog helpers shared by the write path
+(database.py) and the read path (query.py). Sales rows are stored in narrow
+fact tables that hold integer keys into small dimension tables for the
+repeated string columns. Facts are partitioned by month into
+sales_fact_YYYYMM tables (rows without a date stay in sales_fact), listed in
+the fact_partition catalog. The processed_data view joins everything back
+into the original row shape for readers.
+
+Only SQLAlchemy is imported here, so the APIs can load it without pandas.
+"""
+import os
+import logging
+from datetime import datetime
+from sqlalchemy import create_engine, event, MetaData, Table, Column, Integer, BigInteger, String, Float, DateTime, ForeignKey
+from sqlalchemy import LargeBinary, Index, select, func, inspect
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Database connection string
+
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///data_pipeline.db')
+
+# Create SQLAlchemy engine
+engine = create_engine(DATABASE_URL)
+Base = declarative_base()
+Session = sessionmaker(bind=engine)
+
+# Path of the SQLite database file, None for server and in-memory databases
+DATABASE_FILE = engine.url.database if engine.url.get_backend_name() == 'sqlite' and engine.url.database not in (None, '', ':memory:') else None
+
+
+if engine.dialect.name == 'sqlite':
+    @event.listens_for(engine, 'connect')
+    def _sqlite_connect(dbapi_connection, connection_record):
+        # Leave transactions to SQLAlchemy so every one is a real SQLite
+        # transaction: a reader's queries share one snapshot and a load's DDL
+        # rolls back with it
+        dbapi_connection.isolation_level = None
+        if DATABASE_FILE is not None:
+            # WAL lets readers keep the last committed state while a load writes
+            dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    @event.listens_for(engine, 'begin')
+    def _sqlite_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+
+class CustomerLocation(Base):
+    """Dimension table of customer locations"""
+    __tablename__ = 'dim_customer_location'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(String, nullable=False, unique=True)
+
+
+class Gender(Base):
+    """Dimension table of genders"""
+    __tablename__ = 'dim_gender'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(String, nullable=False, unique=True)
+
+
+class MobileName(Base):
+    """Dimension table of mobile device names"""
+    __tablename__ = 'dim_mobile_name'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(String, nullable=False, unique=True)
+
+
+class Answer(Base):
+    """Dimension table of yes/no survey answers, shared by the engagement columns"""
+    __tablename__ = 'dim_answer'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(String, nullable=False, unique=True)
+
+
+class Load(Base):
+    """One row per file load; source_file and processed_at are constant within it"""
+    __tablename__ = 'dim_load'
+
+    id = Column(Integer, primary_key=True)
+    source_file = Column(String, nullable=False)
+    processed_at = Column(DateTime, default=datetime.now)
+
+
+class SalesFact(Base):
+    """SQLAlchemy model for TechCorner sales data, keyed into the dimension tables
+
+    This table holds rows without a date and is the template for the monthly
+    partition tables.
+    """
+    __tablename__ = 'sales_fact'
+    # Serves per-customer history lookups; SQLite appends the rowid (id), so
+    # the index alone finds a customer's rows in date order
+    __table_args__ = (Index('ix_sales_fact_customer_id_date', 'customer_id', 'date'),)
+
+    id = Column(Integer, primary_key=True)
+    customer_id = Column(BigInteger, nullable=True)
+    date = Column(DateTime, nullable=True, index=True)
+    customer_location_id = Column(Integer, ForeignKey('dim_customer_location.id'), nullable=True, index=True)
+    age = Column(Integer, nullable=True)
+    gender_id = Column(Integer, ForeignKey('dim_gender.id'), nullable=True, index=True)
+    mobile_name_id = Column(Integer, ForeignKey('dim_mobile_name.id'), nullable=True, index=True)
+    sell_price = Column(Float, nullable=True)
+    from_facebook_id = Column(Integer, ForeignKey('dim_answer.id'), nullable=True)
+    followed_page_id = Column(Integer, ForeignKey('dim_answer.id'), nullable=True)
+    previous_purchase_id = Column(Integer, ForeignKey('dim_answer.id'), nullable=True)
+    heard_of_shop_id = Column(Integer, ForeignKey('dim_answer.id'), nullable=True)
+    load_id = Column(Integer, ForeignKey('dim_load.id'), nullable=False)
+
+
+class FactPartition(Base):
+    """Catalog of fact partitions and the id/date range each one covers"""
+    __tablename__ = 'fact_partition'
+
+    name = Column(String, primary_key=True)
+    period_start = Column(DateTime, nullable=True)
+    period_end = Column(DateTime, nullable=True)
+    row_count = Column(Integer, nullable=False, default=0)
+    min_id = Column(Integer, nullable=True)
+    max_id = Column(Integer, nullable=True)
+
+
+class ZoneMap(Base):
+    """Min/max statistics, distinct counts and bloom filters for a range of fact rows
+
+    Each load gets one row per partition it wrote to (chunk is NULL) plus one
+    row per chunk of up to zonemap.CHUNK_ROWS rows.
+    """
+    __tablename__ = 'zone_map'
+
+    id = Column(Integer, primary_key=True)
+    partition = Column(String, nullable=False, index=True)
+    load_id = Column(Integer, ForeignKey('dim_load.id'), nullable=False)
+    chunk = Column(Integer, nullable=True)
+    row_count = Column(Integer, nullable=False)
+    min_id = Column(Integer, nullable=False)
+    max_id = Column(Integer, nullable=False)
+    min_date = Column(DateTime, nullable=True)
+    max_date = Column(DateTime, nullable=True)
+    min_age = Column(Integer, nullable=True)
+    max_age = Column(Integer, nullable=True)
+    min_sell_price = Column(Float, nullable=True)
+    max_sell_price = Column(Float, nullable=True)
+    distinct_mobile_names = Column(Integer, nullable=True)
+    distinct_customer_locations = Column(Integer, nullable=True)
+    mobile_name_bloom = Column(LargeBinary, nullable=False)
+    customer_location_bloom = Column(LargeBinary, nullable=False)
+
+
+class CustomerSummary(Base):
+    """Per-customer purchase totals, maintained by every load
+
+    The engagement answers are those of the customer's latest purchase that
+    has them.
+    """
+    __tablename__ = 'customer_summary'
+
+    customer_id = Column(BigInteger, primary_key=True, autoincrement=False)
+    first_purchase = Column(DateTime, nullable=True)
+    last_purchase = Column(DateTime, nullable=True)
+    purchase_count = Column(Integer, nullable=False)
+    total_spend = Column(Float, nullable=False)
+    from_facebook_id = Column(Integer, ForeignKey('dim_answer.id'), nullable=True)
+    followed_page_id = Column(Integer, ForeignKey('dim_answer.id'), nullable=True)
+    previous_purchase_id = Column(Integer, ForeignKey('dim_answer.id'), nullable=True)
+    heard_of_shop_id = Column(Integer, ForeignKey('dim_answer.id'), nullable=True)
+
+
+class LoadedFile(Base):
+    """Remote files stored by a load, with the size and mtime they had when downloaded
+
+    Rows are written in the load's transaction, so watch mode knows exactly
+    which files reached the database.
+    """
+    __tablename__ = 'loaded_file'
+
+    name = Column(String, primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    mtime = Column(Float, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    loaded_at = Column(DateTime, default=datetime.now)
+
+
+class AppliedTask(Base):
+    """Distributed load tasks whose rows are stored, so a retried task is never loaded twice"""
+    __tablename__ = 'applied_task'
+
+    task_key = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.now)
+
+
+UNDATED_PARTITION = SalesFact.__tablename__
+
+# Value columns stored directly on the fact table
+FACT_COLUMNS = ['customer_id', 'date', 'age', 'sell_price']
+
+# Dictionary-encoded columns and the dimension table holding their values
+DIMENSION_COLUMNS = {
+    'customer_location': CustomerLocation,
+    'gender': Gender,
+    'mobile_name': MobileName,
+    'from_facebook': Answer,
+    'followed_page': Answer,
+    'previous_purchase': Answer,
+    'heard_of_shop': Answer
+}
+
+# Yes/no columns summarized per customer
+ENGAGEMENT_COLUMNS = ['from_facebook', 'followed_page', 'previous_purchase', 'heard_of_shop']
+
+# Column order of the processed_data view and of get_data items
+OUTPUT_COLUMNS = [
+    'id', 'customer_id', 'date', 'customer_location', 'age', 'gender', 'mobile_name',
+    'sell_price', 'from_facebook', 'followed_page', 'previous_purchase', 'heard_of_shop',
+    'source_file', 'processed_at'
+]
+
+# Columns filtered with substring matches, served by the search index
+SEARCH_COLUMNS = ['customer_location', 'mobile_name']
+
+# Trigram indexes cannot answer searches shorter than three characters
+MIN_SEARCH_LENGTH = 3
+
+
+def search_table(column):
+    """Name of the FTS5 index over a search column's dimension table"""
+    return f"{DIMENSION_COLUMNS[column].__tablename__}_search"
+
+
+_partition_metadata = MetaData()
+_partition_tables = {}
+
+
+def partition_name(month):
+    """Partition table name for a 'YYYYMM' month key"""
+    return f"{SalesFact.__tablename__}_{month}"
+
+
+def partition_period(month):
+    """[start, end) datetimes covered by a 'YYYYMM' month key"""
+    year, month = int(month[:4]), int(month[4:])
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+
+def partition_table(name):
+    """SQLAlchemy Table for a fact partition, with the same columns and indexes as sales_fact"""
+    if name == UNDATED_PARTITION:
+        return SalesFact.__table__
+    if name not in _partition_tables:
+        # Copied columns keep index=True, so each partition gets its own indexes
+        columns = [column._copy() for column in SalesFact.__table__.columns]
+        _partition_tables[name] = Table(name, _partition_metadata, *columns,
+                                        Index(f"ix_{name}_customer_id_date", 'customer_id', 'date'))
+    return _partition_tables[name]
+
+
+def customer_index(name):
+    """The (customer_id, date) index of a fact partition"""
+    return next(index for index in partition_table(name).indexes if index.name == f"ix_{name}_customer_id_date")
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value, datetime.min.time())
+
+
+def list_partitions(conn, start_date=None, end_date=None):
+    """Catalog rows of the partitions that can hold rows in [start_date, end_date]
+
+    With no date range every partition is returned, including the undated one.
+    ``conn`` may be a Connection or a Session.
+    """
+    partitions = conn.execute(select(FactPartition.__table__).order_by(FactPartition.name)).all()
+    if start_date is None and end_date is None:
+        return partitions
+
+    selected = []
+    for partition in partitions:
+        # Rows without a date never match a date filter
+        if partition.period_start is None:
+            continue
+        if end_date and partition.period_start > _as_datetime(end_date):
+            continue
+        if start_date and partition.period_end <= _as_datetime(start_date):
+            continue
+        selected.append(partition)
+    return selected
+
+
+def processed_data_sql(schema=None, partitions=None):
+    """SELECT that joins the fact partitions back into the denormalized row shape
+
+    ``schema`` prefixes every table, e.g. when the database is attached under
+    another name. ``partitions`` limits the fact tables read (default: only
+    the undated sales_fact table).
+    """
+    prefix = f"{schema}." if schema else ""
+    partitions = partitions or [UNDATED_PARTITION]
+    facts = " UNION ALL ".join(f"SELECT * FROM {prefix}{name}" for name in partitions)
+    select_columns = []
+    joins = []
+    for column in OUTPUT_COLUMNS:
+        if column in DIMENSION_COLUMNS:
+            table = DIMENSION_COLUMNS[column].__tablename__
+            select_columns.append(f"{column}_dim.value AS {column}")
+            joins.append(f"LEFT JOIN {prefix}{table} AS {column}_dim ON {column}_dim.id = f.{column}_id")
+        elif column in ('source_file', 'processed_at'):
+            select_columns.append(f"l.{column} AS {column}")
+        else:
+            select_columns.append(f"f.{column} AS {column}")
+    joins.append(f"JOIN {prefix}dim_load AS l ON l.id = f.load_id")
+
+    return (f"SELECT {', '.join(select_columns)} FROM ({facts}) AS f " + " ".join(joins))
+
+
+def _partitions_missing_zone_maps(conn):
+    """Partitions whose zone maps do not cover all of their rows"""
+    covered = dict(conn.execute(
+        select(ZoneMap.partition, func.sum(ZoneMap.row_count)).where(ZoneMap.chunk.is_(None)).group_by(ZoneMap.partition)
+    ).all())
+    return [partition for partition in list_partitions(conn) if covered.get(partition.name, 0) != partition.row_count]
+
+
+def _partitions_missing_customer_index(conn):
+    """Partitions created before the (customer_id, date) index existed"""
+    inspector = inspect(conn)
+    return [partition for partition in list_partitions(conn)
+            if customer_index(partition.name).name not in {index['name'] for index in inspector.get_indexes(partition.name)}]
+
+
+def schema_is_current(conn):
+    """Whether the database needs no table creation or migration"""
+    inspector = inspect(conn)
+    table_names = set(inspector.get_table_names())
+    if not set(Base.metadata.tables) <= table_names or 'processed_data' in table_names:
+        return False
+    if 'processed_data' not in inspector.get_view_names():
+        return False
+    if conn.execute(select(FactPartition.name).where(FactPartition.name == UNDATED_PARTITION)).first() is None:
+        return False
+    if conn.execute(select(SalesFact.id).where(SalesFact.date.isnot(None)).limit(1)).first() is not None:
+        return False
+    if _partitions_missing_customer_index(conn):
+        return False
+    return not _partitions_missing_zone_maps(conn)
+
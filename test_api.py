@@ -0,0 +1,87 @@
+"""
+Tests for the FastAPI endpoints
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+import api
+from conftest import sales_row, store_csv
+from profiling import prune_profiles
+
+ADMIN_KEY = 'admin_key'
+HEADERS = {'X-API-Key': 'test_api_key'}
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    monkeypatch.setattr(api, 'ADMIN_API_KEYS', [ADMIN_KEY])
+    api.rate_limits.clear()
+    return TestClient(api.app)
+
+
+def test_profiles_need_only_an_admin_key(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(api, 'PROFILE_DIR', str(tmp_path))
+    (tmp_path / '20260101_000000_abcdef12.folded').write_text('MainThread;main (api.py:1) 1\n')
+
+    response = client.get('/admin/profiles/20260101_000000_abcdef12', headers={'X-API-Key': ADMIN_KEY})
+    assert response.status_code == 200
+    assert response.text == 'MainThread;main (api.py:1) 1\n'
+    assert client.get('/admin/profiles/20260101_000000_abcdef12',
+                      headers={'X-API-Key': 'test_api_key'}).status_code == 403
+    assert client.get('/admin/profiles/missing', headers={'X-API-Key': ADMIN_KEY}).status_code == 404
+    # Admin keys are valid API keys too
+    assert client.get('/data', headers={'X-API-Key': ADMIN_KEY}).status_code == 200
+
+
+def test_prune_profiles_keeps_the_newest(tmp_path):
+    for second in range(5):
+        (tmp_path / f"20260101_00000{second}_abcdef12.folded").write_text('')
+    (tmp_path / 'summary.json').write_text('{}')
+
+    prune_profiles(str(tmp_path), keep=2)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        '20260101_000003_abcdef12.folded', '20260101_000004_abcdef12.folded', 'summary.json'
+    ]
+
+
+def test_customer_summary_and_purchases(client, database, tmp_path):
+    store_csv(database, tmp_path / 'sales.csv', [
+        sales_row(7, '27-05-2024'), sales_row(8, '28-05-2024'), sales_row(7, '02-06-2024', mobile_name='iPhone 16 Pro 256GB')
+    ])
+
+    response = client.get('/customers/7', headers=HEADERS)
+    assert response.status_code == 200
+    customer = response.json()
+    assert customer['purchase_count'] == 2
+    assert customer['total_spend'] == 30000.0
+    assert customer['first_purchase'].startswith('2024-05-27')
+    assert [purchase['mobile_name'] for purchase in customer['purchases']] == ['iPhone 16 Pro 256GB', 'Galaxy A55 5G 8/128']
+    assert len(client.get('/customers/7?limit=1', headers=HEADERS).json()['purchases']) == 1
+
+
+@pytest.mark.parametrize('customer_id, status', [
+    (9, 404), (-1, 422), (2**63, 422), ('abc', 422)
+])
+def test_customer_errors(client, customer_id, status):
+    assert client.get(f"/customers/{customer_id}", headers=HEADERS).status_code == status
+
+
+def test_customer_needs_an_api_key(client):
+    assert client.get('/customers/7', headers={'X-API-Key': 'wrong'}).status_code == 401
+
+
+def test_rate_limit_returns_429_per_key(client, monkeypatch):
+    monkeypatch.setattr(api, 'RATE_LIMIT_PER_MINUTE', 3)
+    for _ in range(3):
+        assert client.get('/health', headers=HEADERS).status_code == 200
+
+    response = client.get('/health', headers=HEADERS)
+    assert response.status_code == 429
+    assert response.json()['error'] == 'Rate limit exceeded'
+    # Other keys have their own window
+    assert client.get('/health', headers={'X-API-Key': 'demo_key'}).status_code == 200
+
+    # A new window starts a minute after the first request
+    api.rate_limits['test_api_key']['window_start'] -= 61
+    assert client.get('/health', headers=HEADERS).status_code == 200
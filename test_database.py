@@ -0,0 +1,49 @@
+"""
+Tests for loading data into the partitioned star schema
+"""
+import json
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import select
+
+from conftest import sales_row, store_csv
+from schema import FactPartition, UNDATED_PARTITION
+
+
+def _partition_rows(database):
+    with database.engine.connect() as conn:
+        return dict(conn.execute(select(FactPartition.name, FactPartition.row_count)).all())
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'arrow'])
+def test_rows_are_routed_to_monthly_partitions(database, tmp_path, engine):
+    if engine == 'arrow':
+        pytest.importorskip('pyarrow')
+    store_csv(database, tmp_path / 'sales.csv', [
+        sales_row(1, '27-05-2024'), sales_row(2, '31-05-2024'), sales_row(3, '01-06-2024'), sales_row(4, 'not a date')
+    ], engine)
+
+    assert _partition_rows(database) == {'sales_fact_202405': 2, 'sales_fact_202406': 1, UNDATED_PARTITION: 1}
+    assert database.get_data(limit=10)['total_count'] == 4
+    june = database.get_data(start_date=date(2024, 6, 1), limit=10)
+    assert [item['customer_id'] for item in june['items']] == [3]
+
+    assert database.drop_partitions_before(datetime(2024, 6, 1)) == ['sales_fact_202405']
+    assert _partition_rows(database) == {'sales_fact_202406': 1, UNDATED_PARTITION: 1}
+    assert sorted(item['customer_id'] for item in database.get_data(limit=10)['items']) == [3, 4]
+
+
+def test_arrow_store_routes_dateless_json_to_undated_partition(database, tmp_path):
+    pytest.importorskip('pyarrow')
+    from process import process_json_arrow
+
+    path = tmp_path / 'sales.json'
+    path.write_text(json.dumps([
+        {'customer_id': 1, 'customer_location': 'Rangamati Sadar', 'sell_price': 17073.0},
+        {'customer_id': 2, 'customer_location': 'Inside Rangamati', 'sell_price': 15000.0},
+    ]))
+
+    assert database.store_arrow_table(process_json_arrow(str(path)))
+    assert _partition_rows(database) == {UNDATED_PARTITION: 2}
+    assert database.get_data(limit=10)['total_count'] == 2
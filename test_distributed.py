@@ -0,0 +1,94 @@
+"""
+Tests for the distributed task queue, coordinator and workers
+"""
+import os
+import time
+
+from conftest import sample_lines
+from distributed import TaskQueue, Worker, run_coordinator
+from process import csv_record_ranges, process_file
+
+
+def _drain(queue_path):
+    Worker(TaskQueue(queue_path), batch_size=2, poll_interval=0).run(exit_when_empty=True)
+
+
+def test_coordinator_runs_twice_without_loading_rows_twice(database, sftp_config, tmp_path):
+    queue_path = str(tmp_path / 'queue.db')
+    remote_file = os.path.join(sftp_config['remote_dir'], 'sales.csv')
+    header, lines = sample_lines(100)
+    with open(remote_file, 'w') as f:
+        f.write(header + ''.join(lines))
+
+    assert run_coordinator(sftp_config, queue_path, chunk_rows=30) == 4
+    _drain(queue_path)
+    assert database.get_data(limit=1)['total_count'] == 100
+
+    # A download in a later second would give local copies a new mtime
+    time.sleep(1.1)
+    assert run_coordinator(sftp_config, queue_path, chunk_rows=30) == 0
+    _drain(queue_path)
+    assert database.get_data(limit=1)['total_count'] == 100
+
+    # Only the records appended on the server are queued
+    _, more_lines = sample_lines(10, start=100)
+    with open(remote_file, 'a') as f:
+        f.write(''.join(more_lines))
+    assert run_coordinator(sftp_config, queue_path, chunk_rows=30) == 1
+    _drain(queue_path)
+    assert database.get_data(limit=1)['total_count'] == 110
+    assert TaskQueue(queue_path).counts()['failed'] == 0
+
+
+def test_task_queue_leases_retries_and_gives_up(tmp_path):
+    queue = TaskQueue(str(tmp_path / 'queue.db'), max_attempts=2)
+    assert queue.enqueue('sales.csv:10:1', '/data/sales.csv')
+    assert not queue.enqueue('sales.csv:10:1', '/data/sales.csv')
+
+    task, = queue.lease('worker-1', count=5)
+    assert queue.lease('worker-2') == []
+    # Only the lease owner can finish a task
+    queue.complete([task['id']], 'worker-2')
+    assert queue.counts()['leased'] == 1
+
+    queue.fail([task['id']], 'worker-1', 'processing failed')
+    assert queue.counts()['pending'] == 1
+    task, = queue.lease('worker-2')
+    queue.fail([task['id']], 'worker-2', 'processing failed')
+    assert queue.counts() == {'pending': 0, 'leased': 0, 'done': 0, 'failed': 1}
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    queue = TaskQueue(str(tmp_path / 'queue.db'))
+    queue.enqueue('sales.csv:10:1', '/data/sales.csv')
+    task, = queue.lease('worker-1', lease_seconds=-1)
+
+    taken, = queue.lease('worker-2')
+    assert taken['id'] == task['id']
+    queue.complete([task['id']], 'worker-1')
+    assert queue.counts()['leased'] == 1
+    queue.complete([task['id']], 'worker-2')
+    assert queue.counts()['done'] == 1
+
+
+def test_batches_never_load_a_task_twice(database, tmp_path):
+    path = tmp_path / 'sales.csv'
+    header, lines = sample_lines(10)
+    path.write_text(header + ''.join(lines))
+    queue = TaskQueue(str(tmp_path / 'queue.db'))
+    for start, end, _ in csv_record_ranges(str(path), chunk_rows=5):
+        queue.enqueue(f"sales.csv:{start}-{end}", str(path), start, end)
+    first, second = queue.lease('worker-1', count=2)
+    worker = Worker(queue, poll_interval=0, worker_id='worker-1')
+
+    assert worker.run_batch([first]) == 5
+    # A retried batch skips the task whose rows are already stored
+    assert worker.run_batch([first, second]) == 5
+    assert database.get_data(limit=1)['total_count'] == 10
+    assert queue.counts()['done'] == 2
+
+    # Two workers that both passed that check: the load keeps only new tasks' rows
+    rows = process_file(str(path), byte_range=(first['start_byte'], first['end_byte']))
+    rows = rows.assign(**{database.TASK_KEY_COLUMN: first['task_key']})
+    assert database.store_dataframe(rows, if_exists='append', task_keys=[first['task_key']])
+    assert database.get_data(limit=1)['total_count'] == 10
@@ -0,0 +1,101 @@
+"""
+Parity tests for the pandas and Arrow processing engines
+"""
+import gzip
+import json
+
+import pandas as pd
+import pytest
+
+from process import csv_record_ranges, process_file
+
+pytest.importorskip('pyarrow')
+
+HEADER = ("Cus.ID,Date,Cus. Location,Age,Gender,Mobile Name,Sell Price,"
+          "Does he/she Come from Facebook Page?,Does he/she Followed Our Page?,"
+          "Did he/she buy any mobile before?,Did he/she hear of our shop before?\n")
+
+ROWS = [
+    "1,27-05-2024,Rangamati Sadar,49,F,Galaxy A55 5G 8/128,17073.0,No,Yes,No,Yes\n",
+    # Empty location, mobile and yes/no cells
+    "2,28-05-2024,,30,M,,15000.0,,Yes,no,\n",
+    # Unparseable date and empty gender
+    "3,not a date,Inside Rangamati,25,,iPhone 16 Pro 256GB,120000.0,yes,No,Yes,No\n",
+    "4,29-05-2024,Outside Rangamati,,m,Redmi Note 12 Pro 8/128,,No,No,No,No\n",
+]
+
+
+def _as_frame(result):
+    """Engine output as a plain DataFrame, without the per-run processed_at column"""
+    if not isinstance(result, pd.DataFrame):
+        result = result.to_pandas()
+    result = result.drop(columns=['processed_at'])
+    for column in result.columns:
+        if isinstance(result[column].dtype, pd.CategoricalDtype):
+            result[column] = result[column].astype(object)
+    return result
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "sales.csv"
+    path.write_text(HEADER + "".join(ROWS))
+    return str(path)
+
+
+def test_engines_match_with_empty_cells_and_bad_dates(csv_file):
+    pandas_frame = _as_frame(process_file(csv_file, engine='pandas'))
+    arrow_frame = _as_frame(process_file(csv_file, engine='arrow'))
+
+    assert pandas_frame.loc[1, 'customer_location'] == 'Unknown'
+    assert pandas_frame.loc[1, 'mobile_name'] == 'Unknown'
+    assert pandas_frame.loc[1, 'from_facebook'] == 'unknown'
+    assert pd.isna(pandas_frame.loc[2, 'date'])
+    pd.testing.assert_frame_equal(pandas_frame, arrow_frame, check_dtype=False)
+
+
+def test_engines_match_on_json_with_keys_missing_from_the_first_object(tmp_path):
+    path = tmp_path / "sales.json"
+    path.write_text(json.dumps([
+        {"Cus.ID": 1, "Location": {"City": "Rangamati"}, "Sell Price": 17073.0},
+        {"Cus.ID": 2, "Location": {"City": "Khagrachari", "Zone": "North"}, "Age": 30, "Gender": "M"},
+        {"Cus.ID": 3, "Sell Price": 15000.0, "Gender": None},
+    ]))
+
+    pandas_frame = _as_frame(process_file(str(path), engine='pandas'))
+    arrow_frame = _as_frame(process_file(str(path), engine='arrow'))
+
+    assert {'age', 'gender', 'location_zone'} <= set(arrow_frame.columns)
+    pd.testing.assert_frame_equal(pandas_frame, arrow_frame, check_dtype=False)
+
+
+# A quoted field spanning two lines and a blank line between records
+MULTILINE_ROWS = ROWS[:2] + ['5,30-05-2024,"Rangamati\nSadar",40,F,Galaxy A55 5G 8/128,16000.0,No,No,No,No\n', '\n'] + ROWS[2:]
+
+
+@pytest.mark.parametrize('suffix', ['.csv', '.csv.gz'])
+def test_record_ranges_split_a_file_on_record_boundaries(tmp_path, suffix):
+    path = tmp_path / f"sales{suffix}"
+    data = (HEADER + "".join(MULTILINE_ROWS)).encode()
+    path.write_bytes(gzip.compress(data) if suffix.endswith('.gz') else data)
+
+    ranges = csv_record_ranges(str(path), chunk_rows=2)
+    assert [rows for _, _, rows in ranges] == [2, 2, 1]
+    assert ranges[0][0] == len(HEADER) and ranges[-1][1] == len(data)
+    assert all(previous[1] == following[0] for previous, following in zip(ranges, ranges[1:]))
+
+    whole = _as_frame(process_file(str(path)))
+    chunks = pd.concat([_as_frame(process_file(str(path), byte_range=(start, end))) for start, end, _ in ranges],
+                       ignore_index=True)
+    assert whole.loc[2, 'customer_location'] == 'Rangamati\nSadar'
+    pd.testing.assert_frame_equal(whole, chunks)
+
+
+def test_record_ranges_skip_loaded_rows_and_an_unfinished_last_record(tmp_path):
+    path = tmp_path / "sales.csv"
+    path.write_text(HEADER + "".join(MULTILINE_ROWS) + '6,31-05-2024,"Inside Rangamati')
+
+    (start, end, rows), = csv_record_ranges(str(path), skip_rows=3)
+    assert rows == 2
+    tail = _as_frame(process_file(str(path), byte_range=(start, end)))
+    assert tail['customer_id'].tolist() == [3, 4]
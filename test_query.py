@@ -0,0 +1,49 @@
+"""
+Tests for the read path: zone map pruning and its per-connection cache
+"""
+from datetime import date
+
+from sqlalchemy import select
+
+from conftest import sales_row, store_csv
+from query import candidate_id_ranges
+from schema import MobileName, list_partitions
+
+
+def _ranges(database, **filters):
+    with database.engine.connect() as conn:
+        partition, = [partition for partition in list_partitions(conn) if partition.name == 'sales_fact_202405']
+        return candidate_id_ranges(conn, partition, **filters)
+
+
+def _mobile_key(database, value):
+    with database.engine.connect() as conn:
+        return conn.execute(select(MobileName.id).where(MobileName.value == value)).scalar()
+
+
+def test_zone_maps_skip_files_that_cannot_match(database, tmp_path):
+    # Two files of the same month with disjoint ages, phones and days
+    store_csv(database, tmp_path / 'young.csv',
+              [sales_row(i, '03-05-2024', age=20 + i % 5) for i in range(1, 11)])
+    store_csv(database, tmp_path / 'old.csv',
+              [sales_row(i, '25-05-2024', age=50 + i % 5, mobile_name='iPhone 16 Pro 256GB') for i in range(11, 21)])
+
+    assert _ranges(database) == [(1, 20)]
+    assert _ranges(database, min_age=50) == [(11, 20)]
+    assert _ranges(database, max_age=10) == []
+    assert _ranges(database, start_date=date(2024, 5, 20)) == [(11, 20)]
+    assert _ranges(database, keys={'mobile_name': [_mobile_key(database, 'Galaxy A55 5G 8/128')]}) == [(1, 10)]
+
+    result = database.get_data(min_age=50, mobile_name='iPhone', limit=50)
+    assert [item['customer_id'] for item in result['items']] == list(range(11, 21))
+    assert result['total_count'] == 10
+
+
+def test_cached_zone_maps_are_refreshed_after_a_load(database, tmp_path):
+    store_csv(database, tmp_path / 'first.csv', [sales_row(i, '03-05-2024', age=20) for i in range(1, 6)])
+    assert _ranges(database, min_age=40) == []
+
+    # The pooled connection that cached the zone maps sees the new load
+    store_csv(database, tmp_path / 'second.csv', [sales_row(i, '04-05-2024', age=45) for i in range(6, 11)])
+    assert _ranges(database, min_age=40) == [(6, 10)]
+    assert database.get_data(min_age=40, limit=50)['total_count'] == 5
@@ -0,0 +1,29 @@
+"""
+Tests for watch mode
+"""
+import json
+import os
+
+from conftest import sample_lines
+from watch import PipelineWatcher
+
+
+def test_file_that_fails_to_load_is_retried(database, sftp_config):
+    header, lines = sample_lines(20)
+    with open(os.path.join(sftp_config['remote_dir'], 'sales.csv'), 'w') as f:
+        f.write(header + ''.join(lines))
+    broken = os.path.join(sftp_config['remote_dir'], 'extra.json')
+    with open(broken, 'w') as f:
+        f.write('[{"customer_id": 1,')
+
+    watcher = PipelineWatcher(sftp_config)
+    assert watcher.poll_once() == 20
+    assert 'sales.csv' in watcher._seen
+    assert 'extra.json' not in watcher._seen
+
+    # Once the file is fixed on the server, the next poll picks it up
+    with open(broken, 'w') as f:
+        json.dump([{'customer_id': 1, 'sell_price': 100.0}], f)
+    watcher._close_sftp()
+    assert watcher.poll_once() == 1
+    assert database.get_data(limit=1)['total_count'] == 21
@@ -0,0 +1,211 @@
+"""
+Watch Mode Module
+
+Runs the pipeline as a long-lived daemon that polls the SFTP remote directory
+on a schedule and feeds only new files through the ingest, process and store
+stages. The SFTP transport and database engine stay open between polls.
+"""
+import time
+import random
+import signal
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest import connect_sftp, download_files, local_path_for
+from process import process_file, combine_results, csv_record_ranges
+from compression import split_compression
+from database import (
+    initialize_database, store_dataframe, store_arrow_table, drop_expired_partitions, loaded_files
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineWatcher:
+    """Poll an SFTP directory and load new files incrementally"""
+
+    def __init__(self, sftp_config, interval=60, cron=None, jitter=0.1, max_workers=2, engine='pandas',
+                 retention_months=None):
+        self.sftp_config = sftp_config
+        self.engine = engine
+        self.retention_months = retention_months
+        self.interval = interval
+        self.cron = cron
+        self.jitter = jitter
+        self.max_workers = max_workers
+
+        self._sftp = None
+        self._seen = None
+        self._row_counts = None
+        self._stop_event = threading.Event()
+        self._cron_iter = None
+
+        if cron:
+            try:
+                from croniter import croniter
+            except ImportError:
+                raise RuntimeError("Cron schedules require the 'croniter' package (pip install croniter)")
+            self._cron_iter = croniter(cron, datetime.now())
+
+    def stop(self, *_):
+        """Ask the watcher to exit after the current poll finishes"""
+        if not self._stop_event.is_set():
+            logger.info("Shutdown requested, finishing current poll")
+        self._stop_event.set()
+
+    def _get_sftp(self):
+        """Return a live SFTP client, reconnecting if the transport dropped"""
+        if self._sftp is not None:
+            transport = self._sftp.get_channel().get_transport()
+            if transport is not None and transport.is_active():
+                return self._sftp
+            logger.warning("SFTP transport is no longer active, reconnecting")
+            self._close_sftp()
+
+        self._sftp = connect_sftp(
+            self.sftp_config['host'],
+            self.sftp_config['port'],
+            self.sftp_config['username'],
+            self.sftp_config['password']
+        )
+        return self._sftp
+
+    def _close_sftp(self):
+        if self._sftp is not None:
+            try:
+                self._sftp.close()
+            except Exception as e:
+                logger.warning(f"Error closing SFTP connection: {str(e)}")
+            self._sftp = None
+
+    def _seed_seen(self):
+        """Start from the files recorded as stored in the database"""
+        files = loaded_files()
+        self._seen = {name: (row.size, row.mtime) for name, row in files.items()}
+        self._row_counts = {name: row.row_count for name, row in files.items()}
+        logger.info(f"Watching with {len(self._seen)} previously loaded files")
+
+    def _next_delay(self):
+        """Seconds to sleep before the next poll, including jitter"""
+        if self._cron_iter is not None:
+            delay = max(0.0, self._cron_iter.get_next(float) - time.time())
+        else:
+            delay = float(self.interval)
+        return delay + random.uniform(0, self.jitter * delay)
+
+    def poll_once(self):
+        """Download, process and store any new files; returns rows stored"""
+        sftp = self._get_sftp()
+        if sftp is None:
+            return 0
+
+        try:
+            if self._seen is None:
+                self._seed_seen()
+            # Signatures of the files on the server, remembered per file below
+            pending = dict(self._seen)
+            new_files = download_files(sftp, self.sftp_config['remote_dir'],
+                                       self.sftp_config['local_dir'], seen=pending,
+                                       staging_compression=self.sftp_config.get('staging_compression'))
+        except Exception as e:
+            logger.error(f"Error polling SFTP server: {str(e)}")
+            self._close_sftp()
+            return 0
+
+        if not new_files:
+            logger.info("No new files found")
+            return 0
+
+        # A new file is read whole. A CSV file loaded before that grew is read
+        # from its first record not loaded yet; any other change cannot be
+        # loaded without duplicating rows. Files are only marked seen once
+        # handled, so one that fails to load is downloaded and retried next poll.
+        tasks = []
+        seen = dict(self._seen)
+        for name, signature in pending.items():
+            if self._seen.get(name) == signature:
+                continue
+            local_path = local_path_for(name, self.sftp_config['local_dir'], self.sftp_config.get('staging_compression'))
+            if name not in self._row_counts:
+                tasks.append((name, local_path, None))
+                continue
+            base_name, _ = split_compression(name)
+            if not base_name.endswith('.csv') or signature[0] < self._seen[name][0]:
+                logger.warning(f"{name} changed in place; only rows appended to CSV files are loaded, skipping it")
+                seen[name] = signature
+                continue
+            ranges = csv_record_ranges(local_path, skip_rows=self._row_counts[name])
+            if ranges:
+                tasks.append((name, local_path, (ranges[0][0], ranges[-1][1])))
+            else:
+                seen[name] = signature
+
+        self._seen = seen
+        if not tasks:
+            logger.info("No new rows in the changed files")
+            return 0
+
+        logger.info(f"Processing {len(tasks)} new or appended files")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(
+                lambda task: process_file(task[1], engine=self.engine, byte_range=task[2]), tasks
+            ))
+        dataframes = [df for df in results if df is not None]
+
+        if not dataframes:
+            logger.error("None of the new files could be processed")
+            return 0
+
+        # Recorded with the rows, so a restart resumes from what was committed
+        files = []
+        for (name, _, byte_range), df in zip(tasks, results):
+            if df is not None:
+                size, mtime = pending[name]
+                row_count = len(df) + (self._row_counts[name] if byte_range else 0)
+                files.append({'name': name, 'size': size, 'mtime': mtime, 'row_count': row_count})
+
+        combined_df = combine_results(dataframes, self.engine)
+        store = store_arrow_table if self.engine == 'arrow' else store_dataframe
+        if not store(combined_df, if_exists='append', files=files):
+            logger.error("Failed to store new data in the database")
+            return 0
+
+        self._row_counts.update((file['name'], file['row_count']) for file in files)
+        self._seen.update((file['name'], (file['size'], file['mtime'])) for file in files)
+        if self.retention_months is not None:
+            drop_expired_partitions(self.retention_months)
+        logger.info(f"Loaded {len(combined_df)} rows from {len(dataframes)} files")
+        return len(combined_df)
+
+    def run(self):
+        """Poll until stopped by SIGINT/SIGTERM or stop()"""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+        initialize_database()
+        logger.info("Watch mode started")
+
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    self.poll_once()
+                except Exception as e:
+                    logger.error(f"Unexpected error during poll: {str(e)}")
+
+                delay = self._next_delay()
+                logger.info(f"Next poll in {delay:.1f}s")
+                self._stop_event.wait(delay)
+        finally:
+            self._close_sftp()
+            logger.info("Watch mode stopped")
+
+
+def run_watch(sftp_config, interval=60, cron=None, jitter=0.1, max_workers=2, engine='pandas',
+              retention_months=None):
+    """Run the pipeline in watch mode until interrupted"""
+    watcher = PipelineWatcher(sftp_config, interval=interval, cron=cron, jitter=jitter,
+                              max_workers=max_workers, engine=engine, retention_months=retention_months)
+    watcher.run()
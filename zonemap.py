@@ -0,0 +1,168 @@
+"""
+Zone Map Module
+
+Computes per-chunk statistics (min/max, distinct counts and bloom filters)
+for sales fact rows as they are written, so queries can skip chunks and
+files whose values cannot match the filters.
+"""
+import math
+import hashlib
+
+# Rows per zone map chunk
+CHUNK_ROWS = 4096
+
+# Bloom filter size per chunk; ~1% false positives for a few hundred keys
+BLOOM_BITS = 4096
+BLOOM_HASHES = 5
+
+
+class BloomFilter:
+    """Fixed-size bloom filter over integer dimension keys"""
+
+    def __init__(self, num_bits=BLOOM_BITS, num_hashes=BLOOM_HASHES, data=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bytearray(data) if data is not None else bytearray(num_bits // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little')
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def might_contain(self, key):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+    def union(self, other):
+        """Merge another filter of the same size into this one"""
+        for i, byte in enumerate(other.bits):
+            self.bits[i] |= byte
+        return self
+
+    def to_bytes(self):
+        return bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(num_bits=len(data) * 8, data=data)
+
+
+def _present(values):
+    """Drop missing values (None/NaN/NaT) from a sequence"""
+    present = []
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, float) and math.isnan(value):
+            continue
+        if value != value:  # NaT
+            continue
+        present.append(value)
+    return present
+
+
+def _min_max(values):
+    present = _present(values)
+    if not present:
+        return None, None
+    return min(present), max(present)
+
+
+def _bloom(keys):
+    bloom = BloomFilter()
+    for key in keys:
+        bloom.add(int(key))
+    return bloom
+
+
+def compute_zone_map(columns):
+    """Statistics for one chunk of fact rows
+
+    ``columns`` maps fact column names to equal-length Python sequences and
+    must include id, date, age, sell_price, mobile_name_id and
+    customer_location_id.
+    """
+    min_id, max_id = _min_max(columns['id'])
+    min_date, max_date = _min_max(columns['date'])
+    min_age, max_age = _min_max(columns['age'])
+    min_price, max_price = _min_max(columns['sell_price'])
+    mobile_keys = set(_present(columns['mobile_name_id']))
+    location_keys = set(_present(columns['customer_location_id']))
+
+    return {
+        'row_count': len(columns['id']),
+        'min_id': int(min_id),
+        'max_id': int(max_id),
+        'min_date': min_date,
+        'max_date': max_date,
+        'min_age': min_age,
+        'max_age': max_age,
+        'min_sell_price': min_price,
+        'max_sell_price': max_price,
+        'distinct_mobile_names': len(mobile_keys),
+        'distinct_customer_locations': len(location_keys),
+        'mobile_name_bloom': _bloom(mobile_keys).to_bytes(),
+        'customer_location_bloom': _bloom(location_keys).to_bytes()
+    }
+
+
+def merge_zone_maps(zone_maps):
+    """Combine chunk statistics into statistics for the whole file"""
+    def combine(key, pick):
+        values = [zone_map[key] for zone_map in zone_maps if zone_map[key] is not None]
+        return pick(values) if values else None
+
+    mobile_bloom = BloomFilter()
+    location_bloom = BloomFilter()
+    for zone_map in zone_maps:
+        mobile_bloom.union(BloomFilter.from_bytes(zone_map['mobile_name_bloom']))
+        location_bloom.union(BloomFilter.from_bytes(zone_map['customer_location_bloom']))
+
+    return {
+        'row_count': sum(zone_map['row_count'] for zone_map in zone_maps),
+        'min_id': combine('min_id', min),
+        'max_id': combine('max_id', max),
+        'min_date': combine('min_date', min),
+        'max_date': combine('max_date', max),
+        'min_age': combine('min_age', min),
+        'max_age': combine('max_age', max),
+        'min_sell_price': combine('min_sell_price', min),
+        'max_sell_price': combine('max_sell_price', max),
+        # Upper bounds: the same value can appear in several chunks
+        'distinct_mobile_names': combine('distinct_mobile_names', sum),
+        'distinct_customer_locations': combine('distinct_customer_locations', sum),
+        'mobile_name_bloom': mobile_bloom.to_bytes(),
+        'customer_location_bloom': location_bloom.to_bytes()
+    }
+
+
+def zone_may_match(zone_map, start_date=None, end_date=None, min_age=None, max_age=None, keys=None):
+    """Whether any row summarized by ``zone_map`` could satisfy the filters
+
+    Dates are datetimes; ``keys`` maps 'mobile_name'/'customer_location' to
+    the dimension keys the filter accepts. Bloom filters may be stored bytes
+    or BloomFilter objects. False means the rows can be skipped; True may be
+    a false positive.
+    """
+    if start_date is not None and (zone_map['max_date'] is None or zone_map['max_date'] < start_date):
+        return False
+    if end_date is not None and (zone_map['min_date'] is None or zone_map['min_date'] > end_date):
+        return False
+    if min_age is not None and (zone_map['max_age'] is None or zone_map['max_age'] < min_age):
+        return False
+    if max_age is not None and (zone_map['min_age'] is None or zone_map['min_age'] > max_age):
+        return False
+
+    for column in ('mobile_name', 'customer_location'):
+        if keys and column in keys:
+            bloom = zone_map[f"{column}_bloom"]
+            if not isinstance(bloom, BloomFilter):
+                bloom = BloomFilter.from_bytes(bloom)
+            if not any(bloom.might_contain(int(key)) for key in keys[column]):
+                return False
+
+    return True